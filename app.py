@@ -5,38 +5,143 @@ from flask import (
     send_from_directory,
     abort,
     jsonify,
+    send_file,
+    url_for,
+    g,
+    stream_with_context,
 )
+from werkzeug.security import safe_join
 from datetime import datetime
+import bisect
 import os
-import re
-import html
-
-# For bounding boxes normalization
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
+import threading
+import time
 
 import config
 import parsing
 import chat_state
+import global_search
+import highlight
 import meta_db
+import metrics
+import ocr_store
+import ocr_utils
+import thumbnails
 
 app = Flask(__name__)
 
 
+_ocr_resumed = False
+_ocr_resumed_lock = threading.Lock()
+
+
+@app.before_request
+def resume_ocr():
+    """On the first request, restart OCR of chats with jobs left from a previous run."""
+    global _ocr_resumed
+    if _ocr_resumed:
+        return
+    with _ocr_resumed_lock:
+        # concurrent first requests: only one starts the resume thread
+        if _ocr_resumed:
+            return
+        _ocr_resumed = True
+    if config.WEB_OCR_MODE == "background" and ocr_utils.OCR_AVAILABLE:
+        threading.Thread(
+            target=chat_state.resume_queued_ocr, name="ocr-resume", daemon=True
+        ).start()
+
+
+@app.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    if config.METRICS_ENABLED:
+        metrics.start_request()
+    if config.PROFILE_REQUESTS:
+        g.profiler = metrics.start_profile()
+
+
+@app.after_request
+def add_server_timing(resp):
+    if config.METRICS_ENABLED and "started" in g:
+        total = time.perf_counter() - g.started
+        phases = metrics.finish_request(request.endpoint or "unmatched", total)
+        resp.headers["Server-Timing"] = metrics.server_timing(phases, total)
+    return resp
+
+
+@app.teardown_request
+def dump_profile(exc):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        seconds = time.perf_counter() - g.started
+        path = metrics.stop_profile(profiler, request.endpoint or "unmatched", seconds)
+        if path:
+            print(f"Profiled {request.path} ({seconds * 1000:.0f} ms): {path}")
+
+
 @app.route("/media/<chat_id>/<path:filename>")
 def media(chat_id, filename):
     chat = chat_state.get_chat_state(chat_id)
     if not chat or not os.path.isdir(chat.media_dir):
         abort(404)
     filename = parsing.clean_attachment(filename)
-    full_path = os.path.join(chat.media_dir, filename)
+    full_path = safe_join(chat.media_dir, filename)
+    if full_path is None:
+        abort(404)
     if not os.path.exists(full_path):
         abort(404)
     return send_from_directory(chat.media_dir, filename)
 
 
+@app.route("/thumb/<size>/<chat_id>/<path:filename>")
+def thumb(size, chat_id, filename):
+    """
+    Resized copy of an image attachment, cached on disk by content hash.
+    Falls back to the original when it can't be thumbnailed.
+    """
+    if size not in config.THUMB_SIZES:
+        abort(404)
+    chat = chat_state.get_chat_state(chat_id)
+    if not chat or not os.path.isdir(chat.media_dir):
+        abort(404)
+    filename = parsing.clean_attachment(filename)
+    full_path = safe_join(chat.media_dir, filename)
+    if full_path is None:
+        abort(404)
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        abort(404)
+    if not thumbnails.THUMBS_AVAILABLE:
+        return send_from_directory(chat.media_dir, filename)
+
+    fmt = thumbnails.pick_format(request.accept_mimetypes["image/webp"] > 0)
+    digest = thumbnails.content_hash(full_path, st)
+    etag = f"{digest}-{size}-{fmt}"
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        try:
+            with metrics.phase("thumbnail"):
+                path = thumbnails.get_thumbnail(full_path, digest, size, fmt)
+        except Exception as e:
+            print(f"[{chat_id}] Thumbnail failed for {filename}: {e}")
+            return send_from_directory(chat.media_dir, filename)
+        resp = send_file(
+            os.path.abspath(path),
+            mimetype=thumbnails.MIMETYPES[fmt],
+            etag=False,
+            conditional=False,
+            max_age=config.THUMB_MAX_AGE,
+        )
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = config.THUMB_MAX_AGE
+    resp.vary.add("Accept")
+    return resp
+
+
 @app.route("/image_meta/<chat_id>/<path:filename>", methods=["GET", "POST"])
 def image_meta_route(chat_id, filename):
     chat = chat_state.get_chat_state(chat_id)
@@ -55,35 +160,81 @@ def image_meta_route(chat_id, filename):
     pay = 1 if data.get("payment_record") else 0
     note = data.get("note") or ""
     meta_db.save_image_meta(chat_id, fname, rf, rec, nf, pay, note)
+    chat.search_index.update_note(fname, note)
+    chat.html_cache.invalidate("note", fname)
     return jsonify({"status": "ok"})
 
 
+@app.route("/api/chats/<path:chat_id>/ocr_status")
+def ocr_status(chat_id):
+    chat = chat_state.get_chat_state(chat_id)
+    if not chat:
+        abort(404)
+    progress = ocr_utils.get_progress(chat_id)
+    progress["errors"] = ocr_store.failed_jobs(chat_id)
+    return jsonify(progress)
+
+
+@app.route("/api/cache_stats")
+def cache_stats():
+    return jsonify(chat_state.CHATS.stats())
+
+
+@app.route("/metrics")
+def metrics_route():
+    """Request / phase latency histograms and chat cache stats as Prometheus text."""
+    stats = chat_state.CHATS.stats()
+    cache = [
+        ("wa_chat_cache_bytes", "gauge", "Estimated size of loaded chats.", "bytes"),
+        ("wa_chat_cache_chats", "gauge", "Chats loaded.", "chats"),
+        ("wa_chat_cache_hits_total", "counter", "Chat cache hits.", "hits"),
+        ("wa_chat_cache_misses_total", "counter", "Chat cache misses.", "misses"),
+        (
+            "wa_chat_cache_evictions_total",
+            "counter",
+            "Chats dropped to stay within CHAT_CACHE_MB.",
+            "evictions",
+        ),
+    ]
+    body = metrics.render(
+        [(name, kind, help, stats[key]) for name, kind, help, key in cache]
+    )
+    return app.response_class(body, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/search")
+def global_search_route():
+    """
+    Ranked hits for ?q= across every chat's messages, OCR text and notes,
+    without loading the chats. msg_idx is the message's index in its chat.
+    """
+    q = (request.args.get("q") or "").strip().lower()
+    limit = max(1, min(_int_arg("limit", 50), config.MAX_PAGE_SIZE))
+    with metrics.phase("search"):
+        hits, counts = global_search.search(q, chat_state.discover_chats(), limit)
+    for hit in hits:
+        hit["url"] = url_for("chat_view", chat_id=hit["chat_id"], q=q)
+    return jsonify(
+        {"q": q, "total": sum(counts.values()), "chats": counts, "hits": hits}
+    )
+
+
 @app.route("/")
 def picker():
     chats = chat_state.discover_chats()
     return render_template("picker.html", chats=chats)
 
 
-@app.route("/chats/<path:chat_id>")
-def chat_view(chat_id):
-    chat = chat_state.get_chat_state(chat_id)
-    if not chat or not chat.messages:
-        return f"Chat '{chat_id}' not found or _chat.txt is empty.", 404
-
-    messages = chat.messages
-    image_ocr = chat.image_ocr
-    image_boxes = chat.image_boxes
-    media_dir = chat.media_dir
+STATUS_KEYS = meta_db.STATUS_FLAGS
 
-    q_raw = (request.args.get("q") or "").strip()
-    q = q_raw.lower()
 
-    search_notes_flag = request.args.get("search_notes", "1")
-    search_notes = search_notes_flag == "1"
+def parse_view_args(args):
+    """Read the search / date / status filters shared by the page and the API."""
+    q_raw = (args.get("q") or "").strip()
 
     # date filters
-    start_str = (request.args.get("start") or "").strip()
-    end_str = (request.args.get("end") or "").strip()
+    start_str = (args.get("start") or "").strip()
+    end_str = (args.get("end") or "").strip()
     start_date = None
     end_date = None
     if start_str:
@@ -97,191 +248,411 @@ def chat_view(chat_id):
         except ValueError:
             end_date = None
 
-    # status filters
-    status_keys = ["record_found", "recorded", "not_found", "payment_record"]
-    include_filters = {k: bool(request.args.get(f"inc_{k}")) for k in status_keys}
-    exclude_filters = {k: bool(request.args.get(f"exc_{k}")) for k in status_keys}
-
-    # collect filenames
-    all_filenames = set()
-    for msg in messages:
-        for fname in msg.get("attachments", []):
-            all_filenames.add(fname)
-
+    return {
+        "q_raw": q_raw,
+        "q": q_raw.lower(),
+        "search_notes": args.get("search_notes", "1") == "1",
+        "start_date": start_date,
+        "end_date": end_date,
+        "include_filters": {k: bool(args.get(f"inc_{k}")) for k in STATUS_KEYS},
+        "exclude_filters": {k: bool(args.get(f"exc_{k}")) for k in STATUS_KEYS},
+    }
+
+
+def filter_positions(chat, view):
+    """
+    Message indexes passing the date filter, in chat order. Position i in the
+    returned sequence is what the page and the API call message "i".
+    """
+    start_date = view["start_date"]
+    end_date = view["end_date"]
+    if not start_date and not end_date:
+        return range(len(chat.messages))
+    return chat.time_index.select(start_date, end_date)
+
+
+def match_positions(order, hits):
+    """Sorted positions in order whose message index is in hits."""
+    positions = []
+    for idx in sorted(hits):
+        pos = bisect.bisect_left(order, idx)
+        if pos < len(order) and order[pos] == idx:
+            positions.append(pos)
+    return positions
+
+
+def window_bounds(total: int, cursor: int, limit: int, around=None):
+    """Clamp a [start, end) window of at most limit positions."""
+    limit = max(1, min(limit, config.MAX_PAGE_SIZE))
+    if around is not None:
+        start = max(0, min(around - limit // 2, total - limit))
+    else:
+        start = max(0, min(cursor, total))
+    return start, min(total, start + limit)
+
+
+def build_window(chat, view, order, start, end, hits):
+    """
+    Render-ready dicts for positions [start, end) of order, plus the image
+    meta and note HTML for their attachments.
+    """
     image_meta_map = {}
     image_note_html = {}
+    window = list(
+        iter_window(
+            chat, view, order, start, end, hits, image_meta_map, image_note_html
+        )
+    )
+    return window, image_meta_map, image_note_html
+
+
+def iter_window(chat, view, order, start, end, hits, image_meta_map, image_note_html):
+    """
+    Yield render-ready dicts for positions [start, end) of order, adding the
+    image meta and note HTML of each message's attachments to the two maps
+    before the message is yielded. Only text of messages that matched is
+    highlighted; "spans" are the [start, end) offsets of the query in each
+    message's text.
+    """
+    q = view["q"]
+    search_notes = view["search_notes"]
+    base_hits, ocr_hits = hits
+    hl = highlight.Highlighter(view["q_raw"], chat.html_cache)
+    render = hl.render
+    image_exts = parsing.IMAGE_EXTS
+
+    with metrics.phase("meta"):
+        chat_meta = meta_db.get_chat_meta(chat.chat_id)
+
+    for pos in range(start, end):
+        idx = order[pos]
+        msg = chat.messages[idx]
+        ocr_match = idx in ocr_hits
+        base_match = idx in base_hits
 
-    def highlight_text(text: str) -> str:
-        if not text:
-            return ""
-        base = html.escape(text)
-        if not q_raw:
-            return base
-        pattern = re.compile(re.escape(q_raw), re.IGNORECASE)
-
-        def _repl(m):
-            return f'<span class="hl">{m.group(0)}</span>'
-
-        return pattern.sub(_repl, base)
-
-    # load meta for all files
-    for fname in all_filenames:
-        meta = meta_db.get_image_meta(chat_id, fname)
-        image_meta_map[fname] = meta
-        note = meta.get("note") or ""
-        if not note:
-            image_note_html[fname] = ""
-        else:
-            if q and search_notes:
-                image_note_html[fname] = highlight_text(note)
-            else:
-                image_note_html[fname] = html.escape(note)
-
-    filtered = []
-    match_count = 0
-    image_exts = (".jpg", ".jpeg", ".png", ".gif", ".webp")
-
-    for msg in messages:
-        dt = msg["datetime"]
-        msg_date = dt.date() if dt else None
-
-        # date filter
-        if start_date and msg_date and msg_date < start_date:
-            continue
-        if end_date and msg_date and msg_date > end_date:
-            continue
-
-        img_text_blob = ""
         attachment_ocr = {}
         attachment_boxes = {}
-        msg_note_blob = ""
 
-        for fname in msg.get("attachments", []):
+        for fname in msg.attachments:
             key = parsing.clean_attachment(fname)
             lower = key.lower()
 
+            if fname not in image_meta_map:
+                meta = chat_meta.get(fname) or meta_db.empty_meta()
+                image_meta_map[fname] = meta
+                note = meta.get("note") or ""
+                spans = hl.spans(note) if base_match and search_notes else []
+                image_note_html[fname] = render("note", key, note, spans)
+
             ocr_txt = ""
             if lower.endswith(image_exts):
-                ocr_txt = image_ocr.get(key, "")
-                img_text_blob += " " + (ocr_txt or "")
-            if ocr_txt:
-                attachment_ocr[fname] = (
-                    highlight_text(ocr_txt) if q else html.escape(ocr_txt)
-                )
-            else:
-                attachment_ocr[fname] = ""
-
-            # bounding boxes (normalized) when searching
+                ocr_txt = chat.image_ocr.get(key, "")
+            spans = hl.spans(ocr_txt) if ocr_match else []
+            attachment_ocr[fname] = render("ocr", key, ocr_txt, spans)
+
+            # bounding boxes (stored normalized) when searching
             boxes = []
-            if q and lower.endswith(image_exts) and Image is not None:
-                raw_boxes = image_boxes.get(key, [])
-                image_path = os.path.join(media_dir, key)
-                img_w = img_h = None
-                try:
-                    with Image.open(image_path) as im:
-                        img_w, img_h = im.size
-                except Exception:
-                    img_w = img_h = None
-
-                if img_w and img_h:
-                    for b in raw_boxes:
-                        word_text = b.get("text", "")
-                        if q in word_text:
-                            x = b["left"] / img_w
-                            y = b["top"] / img_h
-                            w = b["width"] / img_w
-                            h = b["height"] / img_h
-                            boxes.append({"x": x, "y": y, "w": w, "h": h})
+            if q and lower.endswith(image_exts):
+                for b in chat.image_boxes.get(key, []):
+                    if "x" in b and q in b.get("text", ""):
+                        boxes.append(
+                            {"x": b["x"], "y": b["y"], "w": b["w"], "h": b["h"]}
+                        )
             attachment_boxes[fname] = boxes
 
-            meta = image_meta_map.get(fname, {"note": ""})
-            note = (meta.get("note") or "").lower()
-            msg_note_blob += " " + note
-
-        base_match = False
-        ocr_match = False
-        has_match = False
-
-        if q:
-            combo = f"{msg['sender']} {msg['text']}".lower()
-            if search_notes:
-                combo += msg_note_blob
-            base_match = q in combo
-            ocr_match = q in img_text_blob if img_text_blob else False
-            has_match = base_match or ocr_match
-            if has_match:
-                match_count += 1
-        else:
-            has_match = False
-
-        new_msg = dict(msg)
-        new_msg["display_text"] = highlight_text(msg["text"])
-        new_msg["image_match"] = ocr_match
-        new_msg["has_match"] = has_match
-        new_msg["attachment_ocr"] = attachment_ocr
-        new_msg["attachment_boxes"] = attachment_boxes
-        filtered.append(new_msg)
-
-    # side-panel filtered images
-    filtered_images_map = {}
-    for idx, msg in enumerate(filtered):
-        for fname in msg.get("attachments", []):
-            lower = fname.lower()
-            if not lower.endswith(image_exts):
-                continue
-            if fname in filtered_images_map:
-                continue
-            meta = image_meta_map.get(
-                fname,
-                {
-                    "record_found": 0,
-                    "recorded": 0,
-                    "not_found": 0,
-                    "payment_record": 0,
-                    "note": "",
-                },
-            )
+        spans = hl.spans(msg.text) if base_match else []
+        yield {
+            "pos": pos,
+            "idx": idx,
+            "datetime": msg.datetime,
+            "sender": msg.sender,
+            "attachments": msg.attachments,
+            "display_text": render("msg", idx, msg.text, spans),
+            "spans": spans,
+            "image_match": ocr_match,
+            "has_match": ocr_match or base_match,
+            "attachment_ocr": attachment_ocr,
+            "attachment_boxes": attachment_boxes,
+        }
+
+
+def boost_window_ocr(chat, order, start, end):
+    """Queue OCR of the window's images ahead of the rest of the chat."""
+    ocr_utils.boost_jobs(
+        chat.chat_id,
+        [a for idx in order[start:end] for a in chat.messages[idx].attachments],
+    )
+
+
+def image_positions(chat, order):
+    """
+    {filename: (position, rank)} for each image attached to a message in
+    order: the position of its first such message and its rank in
+    chat.attachments, which together give side-panel order.
+    """
+    image_exts = parsing.IMAGE_EXTS
+    file_msgs = chat.search_index.file_msgs
+    n = len(order)
+    out = {}
+    for rank, fname in enumerate(chat.attachments):
+        if not fname.lower().endswith(image_exts):
+            continue
+        for idx in file_msgs.get(fname, ()):
+            pos = bisect.bisect_left(order, idx)
+            if pos < n and order[pos] == idx:
+                out[fname] = (pos, rank)
+                break
+            if pos >= n:
+                break
+    return out
+
+
+def filtered_images_for(chat, view, order, lazy=False):
+    """
+    Side-panel images passing the include / exclude status filters, plus
+    per-status counts over all images in order. With lazy, the images are a
+    generator producing each entry as the template reaches it.
+    """
+    positions = image_positions(chat, order)
+    flags = meta_db.get_chat_flags(chat.chat_id)
+    names = set(positions)
+    for k, inc in view["include_filters"].items():
+        if inc:
+            names &= flags[k]
+    for k, ex in view["exclude_filters"].items():
+        if ex:
+            names -= flags[k]
+
+    chat_meta = meta_db.get_chat_meta(chat.chat_id)
+    no_meta = meta_db.empty_meta()
+    images = (
+        {
+            "filename": fname,
+            "meta": chat_meta.get(fname) or no_meta,
+            "msg_idx": positions[fname][0],
+            "datetime": chat.messages[order[positions[fname][0]]].datetime,
+        }
+        for fname in sorted(names, key=positions.__getitem__)
+    )
+    counts = {
+        "total": len(positions),
+        "shown": len(names),
+        "flags": {k: len(flags[k].intersection(positions)) for k in STATUS_KEYS},
+    }
+    return (images if lazy else list(images)), counts
+
+
+def _int_arg(name, default=None):
+    try:
+        return int(request.args.get(name))
+    except (TypeError, ValueError):
+        return default
+
+
+@app.route("/chats/<path:chat_id>")
+def chat_view(chat_id):
+    with metrics.phase("chat"):
+        chat = chat_state.get_chat_state(chat_id)
+    if not chat or not chat.messages:
+        return f"Chat '{chat_id}' not found or _chat.txt is empty.", 404
 
-            # include filters
-            include_ok = True
-            if any(include_filters.values()):
-                for k, inc in include_filters.items():
-                    if inc and not meta.get(k, 0):
-                        include_ok = False
-                        break
-            if not include_ok:
-                continue
-
-            # exclude filters
-            exclude_fail = False
-            for k, ex in exclude_filters.items():
-                if ex and meta.get(k, 0):
-                    exclude_fail = True
-                    break
-            if exclude_fail:
-                continue
-
-            filtered_images_map[fname] = {
-                "filename": fname,
-                "meta": meta,
-                "msg_idx": idx,
-            }
-
-    filtered_images = list(filtered_images_map.values())
-
-    return render_template(
-        "chat.html",
-        filtered=filtered,
-        total=len(messages),
+    view = parse_view_args(request.args)
+    with metrics.phase("filter"):
+        order = filter_positions(chat, view)
+    with metrics.phase("search"):
+        hits = chat.search_index.search(view["q"], view["search_notes"], order)
+        matches = match_positions(order, hits[0] | hits[1])
+
+    # open on the first match when searching, otherwise at the top
+    around = matches[0] if matches else None
+    start, end = window_bounds(len(order), 0, config.PAGE_SIZE, around)
+    boost_window_ocr(chat, order, start, end)
+    lo = bisect.bisect_left(matches, start)
+    hi = bisect.bisect_left(matches, end)
+    stream = config.STREAM_PAGES
+    if stream:
+        # messages and side-panel entries are built as the template reaches
+        # them; the maps fill in step with the window generator
+        image_meta_map = {}
+        image_note_html = {}
+        window = iter_window(
+            chat, view, order, start, end, hits, image_meta_map, image_note_html
+        )
+    else:
+        with metrics.phase("window"):
+            window, image_meta_map, image_note_html = build_window(
+                chat, view, order, start, end, hits
+            )
+    with metrics.phase("images"):
+        filtered_images, image_counts = filtered_images_for(
+            chat, view, order, lazy=stream
+        )
+
+    context = dict(
+        window=window,
+        window_start=start,
+        window_end=end,
+        window_matches=matches[lo:hi],
+        match_offset=lo,
+        page_size=config.PAGE_SIZE,
+        total_filtered=len(order),
+        total=len(chat.messages),
         self_name=config.SELF_NAME,
-        match_count=match_count,
+        match_count=len(matches),
         image_meta_map=image_meta_map,
         image_note_html=image_note_html,
         filtered_images=filtered_images,
+        image_counts=image_counts,
         chat_id=chat_id,
     )
+    if stream:
+        return stream_page("chat.html", **context)
+    with metrics.phase("render"):
+        return render_template("chat.html", **context)
+
+
+def stream_page(template_name: str, **context):
+    """
+    Response that renders template_name as the client reads it, sent in
+    chunks of STREAM_CHUNK template pieces. Its render time is recorded as
+    the "render_stream" phase once the last chunk is out (after the
+    Server-Timing header has gone).
+    """
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    chunks = template.stream(context)
+    chunks.enable_buffering(config.STREAM_CHUNK)
+    if config.METRICS_ENABLED:
+        chunks = _timed_stream(chunks)
+    return app.response_class(stream_with_context(chunks), mimetype="text/html")
+
+
+def _timed_stream(chunks):
+    started = time.perf_counter()
+    try:
+        yield from chunks
+    finally:
+        metrics.record("render_stream", time.perf_counter() - started)
+
+
+@app.route("/api/chats/<path:chat_id>/images")
+def chat_images_api(chat_id):
+    """Side-panel image list and status counts for the page's filters."""
+    chat = chat_state.get_chat_state(chat_id)
+    if not chat:
+        abort(404)
+    view = parse_view_args(request.args)
+    order = filter_positions(chat, view)
+    images, counts = filtered_images_for(chat, view, order)
+    return jsonify(
+        {
+            "images": [
+                {
+                    "filename": img["filename"],
+                    "pos": img["msg_idx"],
+                    "datetime": img["datetime"].isoformat() if img["datetime"] else None,
+                    **img["meta"],
+                }
+                for img in images
+            ],
+            "counts": counts,
+        }
+    )
+
+
+@app.route("/api/chats/<path:chat_id>/timeline")
+def chat_timeline_api(chat_id):
+    """Messages per day, for a timeline / histogram."""
+    chat = chat_state.get_chat_state(chat_id)
+    if not chat:
+        abort(404)
+    index = chat.time_index
+    return jsonify(
+        {
+            "days": [
+                {"date": day.isoformat(), "count": n} for day, n in index.timeline()
+            ],
+            "undated": len(index.undated),
+        }
+    )
+
+
+@app.route("/api/chats/<path:chat_id>/messages")
+def chat_messages_api(chat_id):
+    """
+    One window of the filtered message sequence as JSON.
+
+    Query args are the page's filters plus ``cursor`` / ``limit`` for a plain
+    slice, ``around`` to centre the window on a position, or ``match`` to
+    centre it on the Nth (0-based) search match.
+    """
+    with metrics.phase("chat"):
+        chat = chat_state.get_chat_state(chat_id)
+    if not chat:
+        abort(404)
+
+    view = parse_view_args(request.args)
+    with metrics.phase("filter"):
+        order = filter_positions(chat, view)
+    with metrics.phase("search"):
+        hits = chat.search_index.search(view["q"], view["search_notes"], order)
+        matches = match_positions(order, hits[0] | hits[1])
+
+    cursor = _int_arg("cursor", 0)
+    limit = _int_arg("limit", config.PAGE_SIZE)
+    around = _int_arg("around")
+    focus = around
+    match_n = _int_arg("match")
+    if match_n is not None and matches:
+        focus = matches[match_n % len(matches)]
+        around = focus
+
+    start, end = window_bounds(len(order), cursor, limit, around)
+    boost_window_ocr(chat, order, start, end)
+    with metrics.phase("window"):
+        window, image_meta_map, image_note_html = build_window(
+            chat, view, order, start, end, hits
+        )
+    lo = bisect.bisect_left(matches, start)
+    hi = bisect.bisect_left(matches, end)
+
+    with metrics.phase("render"):
+        rendered = render_template(
+            "_messages.html",
+            window=window,
+            self_name=config.SELF_NAME,
+            image_meta_map=image_meta_map,
+            image_note_html=image_note_html,
+            chat_id=chat_id,
+        )
+
+    return jsonify(
+        {
+            "cursor": start,
+            "end": end,
+            "next_cursor": end if end < len(order) else None,
+            "total": len(order),
+            "match_count": len(matches),
+            "match_offset": lo,
+            "matches": matches[lo:hi],
+            "focus": focus,
+            "messages": [
+                {
+                    "pos": m["pos"],
+                    "idx": m["idx"],
+                    "datetime": m["datetime"].isoformat() if m["datetime"] else None,
+                    "sender": m["sender"],
+                    "has_match": m["has_match"],
+                    "image_match": m["image_match"],
+                    "spans": m["spans"],
+                }
+                for m in window
+            ],
+            "html": rendered,
+        }
+    )
 
 
 if __name__ == "__main__":
     print("Open http://127.0.0.1:5000 in your browser.")
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)
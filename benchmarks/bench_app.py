@@ -0,0 +1,231 @@
+"""
+End-to-end benchmark on a synthetic export: parse throughput, chat load
+latency (cold and from snapshot), OCR indexing, search and page render
+latency (p50 / p99) and peak RSS. Results are saved as JSON so runs on
+different commits can be compared.
+
+    python benchmarks/bench_app.py [--messages 100000] [--images] [--out FILE]
+    python benchmarks/bench_app.py --compare OLD.json NEW.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO)
+
+import synth_export  # noqa: E402
+
+CHAT_ID = "Synthetic"
+QUERIES = ["invoice", "pa", "see you", "tomorrow thanks", "total", "zzzz"]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    k = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[k]
+
+
+def latency(samples):
+    """p50 / p99 / max in milliseconds."""
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def timed(fn, *args, **kw):
+    start = time.perf_counter()
+    result = fn(*args, **kw)
+    return result, time.perf_counter() - start
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO, text=True
+        ).strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO, text=True
+        ).strip()
+        return commit, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def ocr_usable():
+    import ocr_utils
+
+    if not ocr_utils.OCR_AVAILABLE:
+        return False
+    return shutil.which(ocr_utils.pytesseract.pytesseract.tesseract_cmd) is not None
+
+
+def run_benchmark(args, export):
+    """Run every phase inside the current directory (a scratch CHAT_ROOT)."""
+    import parsing
+    import app
+    import chat_state
+    import ocr_utils
+
+    results = {}
+    base_dir = os.path.join("chats", CHAT_ID)
+    chat_file = os.path.join(base_dir, "_chat.txt")
+
+    parse_times = [timed(parsing.parse_chat, chat_file)[1] for _ in range(args.repeat)]
+    best = min(parse_times)
+    results["parse"] = {
+        "seconds": round(best, 4),
+        "lines_per_s": round(export["lines"] / best),
+        "mb_per_s": round(export["bytes"] / 1e6 / best, 2),
+    }
+    results["rss_after_parse_mb"] = peak_rss_mb()
+
+    # parse + index + snapshot write, OCR left out so it can be timed alone
+    chat = chat_state.ChatState(CHAT_ID, base_dir, ocr_mode="cached")
+    _, cold = timed(chat.load)
+    warm_chat = chat_state.ChatState(CHAT_ID, base_dir, ocr_mode="cached")
+    _, warm = timed(warm_chat.load)
+    results["load"] = {"cold_s": round(cold, 4), "snapshot_s": round(warm, 4)}
+
+    if export["images"] and ocr_usable():
+        _, ocr_s = timed(ocr_utils.build_image_ocr_index_for_chat, chat, background=False)
+        chat.build_search_index()
+        progress = ocr_utils.get_progress(CHAT_ID)
+        results["ocr"] = {
+            "seconds": round(ocr_s, 3),
+            "images": export["images"],
+            "images_per_s": round(export["images"] / ocr_s, 1),
+            "reused": progress["deduped"],
+            "failed": progress["failed"],
+            "rejected": progress["rejected"],
+            "extra_passes": progress["extra_passes"],
+            "tesseract_saved_s": progress["saved_s"],
+        }
+    else:
+        results["ocr"] = None
+    results["rss_after_load_mb"] = peak_rss_mb()
+
+    samples = []
+    per_query = {}
+    for q in QUERIES:
+        q_samples = [
+            timed(chat.search_index.search, q, True)[1] for _ in range(args.repeat * 10)
+        ]
+        per_query[q] = latency(q_samples)
+        samples.extend(q_samples)
+    results["search"] = {"all": latency(samples), "queries": per_query}
+
+    chat_state.CHATS.put(CHAT_ID, chat)
+    client = app.app.test_client()
+    pages = {
+        "chat_page": f"/chats/{CHAT_ID}",
+        "chat_page_search": f"/chats/{CHAT_ID}?q=invoice",
+        "messages_api_middle": (
+            f"/api/chats/{CHAT_ID}/messages?cursor={len(chat.messages) // 2}"
+        ),
+        "global_search": "/search?q=invoice",
+    }
+    results["render"] = {}
+    for name, url in pages.items():
+        page_samples = []
+        for _ in range(args.repeat * 3):
+            # buffered: read the whole body, or streamed pages time headers only
+            resp, t = timed(client.get, url, buffered=True)
+            if resp.status_code != 200:
+                raise RuntimeError(f"{url} returned {resp.status_code}")
+            page_samples.append(t)
+        results["render"][name] = latency(page_samples)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in (d or {}).items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'metric':48} {old.get('commit') or '?':>12} {new.get('commit') or '?':>12}")
+    a, b = flatten(old["results"]), flatten(new["results"])
+    for key in sorted(set(a) | set(b)):
+        va, vb = a.get(key), b.get(key)
+        ratio = f"{vb / va:6.2f}x" if va and vb is not None else ""
+        va = "-" if va is None else va
+        vb = "-" if vb is None else vb
+        print(f"{key:48} {va:>12} {vb:>12} {ratio}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    synth_export.add_export_args(ap)
+    ap.add_argument("--repeat", type=int, default=3, help="runs per timed phase")
+    ap.add_argument("--workdir", help="scratch directory to keep (default: temporary)")
+    ap.add_argument("--out", help="results file (default: bench-<commit>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit, dirty = git_commit()
+    out = os.path.abspath(args.out or f"bench-{commit or 'unknown'}.json")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="wa-bench-")
+    try:
+        chat_dir = os.path.join(workdir, "chats", CHAT_ID)
+        export = synth_export.write_export(
+            chat_dir, args.messages, **synth_export.export_kwargs(args)
+        )
+        # config paths are relative, so the app's databases land in workdir
+        os.chdir(workdir)
+        results = run_benchmark(args, export)
+    finally:
+        os.chdir(REPO)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("compare", "out")},
+        "export": export,
+        "results": results,
+    }
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Saved {out}")
+
+
+if __name__ == "__main__":
+    main()
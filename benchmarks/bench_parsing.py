@@ -0,0 +1,158 @@
+"""
+Compare parsing.parse_chat with the previous implementation on a synthetic
+export and check both produce the same messages.
+
+    python benchmarks/bench_parsing.py [--messages 900000] [--date-format 0..3]
+"""
+
+from datetime import datetime
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import parsing  # noqa: E402
+import synth_export  # noqa: E402
+
+
+def legacy_parse_chat(path: str):
+    """parsing.parse_chat as it was before the streaming rewrite."""
+    invisible = list(parsing.WHATSAPP_INVISIBLE)
+
+    def strip(s):
+        if not s:
+            return s
+        return "".join(ch for ch in s if ch not in invisible)
+
+    def parse_dt(dt_str):
+        dt_str = dt_str.replace("\u202f", " ")
+        dt_str = strip(dt_str)
+        dt_str = " ".join(dt_str.split())
+        for fmt in parsing.DATE_FORMATS:
+            try:
+                return datetime.strptime(dt_str, fmt)
+            except ValueError:
+                continue
+        return None
+
+    messages = []
+    current = None
+    attach_re = re.compile(r"<attached:\s*([^>]+)>", re.IGNORECASE)
+
+    with open(path, "r", encoding="utf-8") as f:
+        for raw_line in f:
+            line = strip(raw_line.rstrip("\n"))
+            if not line.strip():
+                continue
+            is_new_message = False
+            if line.startswith("[") and "]" in line and ":" in line:
+                try:
+                    closing = line.index("]")
+                    dt_str = line[1:closing]
+                    rest = line[closing + 2 :]
+                    if ": " in rest:
+                        sender, text = rest.split(": ", 1)
+                    else:
+                        sender, text = "Unknown", rest
+                    dt = parse_dt(dt_str)
+                    if dt is not None:
+                        is_new_message = True
+                except Exception:
+                    is_new_message = False
+            if is_new_message:
+                if current:
+                    messages.append(current)
+                sender = strip(sender).strip()
+                text = strip(text)
+                attachments = [strip(a).strip() for a in attach_re.findall(text)]
+                current = {
+                    "datetime": dt,
+                    "sender": sender,
+                    "text": attach_re.sub("", text).strip(),
+                    "attachments": attachments,
+                }
+            elif current:
+                current["text"] += "\n" + line
+            else:
+                current = {
+                    "datetime": None,
+                    "sender": "System",
+                    "text": line,
+                    "attachments": [],
+                }
+    if current:
+        messages.append(current)
+    return messages
+
+
+def month_first_diffs(old, new):
+    """
+    Messages whose datetime differs only because the legacy parser read a
+    date fitting both layouts day-first, where parse_chat follows the
+    export's month-first layout. None if anything else differs.
+    """
+    if len(old) != len(new):
+        return None
+    diffs = 0
+    for a, b in zip(old, new):
+        if a == b:
+            continue
+        da, db = a["datetime"], b["datetime"]
+        if dict(a, datetime=None) != dict(b, datetime=None) or da is None or db is None:
+            return None
+        if db.day > 12 or da != db.replace(month=db.day, day=db.month):
+            return None
+        diffs += 1
+    return diffs
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--messages", type=int, default=900_000)
+    ap.add_argument("--date-format", type=int, default=0, choices=range(4))
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "_chat.txt")
+        # about 1.1 lines per message; most senders wrapped in direction marks
+        lines, _ = synth_export.write_chat_txt(
+            path, args.messages, args.date_format, invisible=2 / 3
+        )
+        size_mb = os.path.getsize(path) / 1e6
+
+        old, t_old = timed(legacy_parse_chat, path)
+        new, t_new = timed(parsing.parse_chat, path)
+        new_dicts = [m.as_dict() for m in new]
+        streamed = 0
+        start = time.perf_counter()
+        for _ in parsing.iter_chat(path):
+            streamed += 1
+        t_stream = time.perf_counter() - start
+
+    print(f"{lines} lines, {size_mb:.1f} MB, {len(new)} messages")
+    print(f"legacy parse_chat : {t_old:7.2f}s  {lines / t_old:10.0f} lines/s")
+    print(f"parse_chat        : {t_new:7.2f}s  {lines / t_new:10.0f} lines/s")
+    print(f"iter_chat (stream): {t_stream:7.2f}s  {lines / t_stream:10.0f} lines/s")
+    print(f"speedup           : {t_old / t_new:7.2f}x")
+    diffs = month_first_diffs(old, new_dicts)
+    if diffs is None or streamed != len(new):
+        print("MISMATCH between legacy and new parser output")
+        sys.exit(1)
+    if diffs:
+        print(f"outputs identical but for {diffs} ambiguous dates read month-first")
+    else:
+        print("outputs identical")
+
+
+if __name__ == "__main__":
+    main()
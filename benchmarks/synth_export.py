@@ -0,0 +1,145 @@
+"""
+Write synthetic WhatsApp exports for benchmarks: a chat folder with
+_chat.txt and Media/ holding generated images with text for OCR.
+
+    python benchmarks/synth_export.py OUT_DIR [--messages 100000] [--images]
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import shutil
+
+# the date part of each DATE_FORMATS layout; the time is written by hand
+# since strftime has no portable unpadded hour (%-I is glibc-only)
+SYNTH_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%m/%d/%Y"]
+
+WORDS = "payment done invoice sent ok see you tomorrow thanks bill".split()
+IMAGE_WORDS = "invoice receipt total paid amount due bank transfer ref order".split()
+SENDERS = ["Sohel Shekh", "Alice", "Bob K"]
+# the marks WhatsApp puts around names and attachments
+INVISIBLE = ["\u200e", "\u200f", "\u202a", "\u202c", "\u2068", "\u2069"]
+
+
+def write_chat_txt(
+    path: str,
+    n_messages: int,
+    fmt_idx: int = 0,
+    multiline: float = 0.1,
+    attach: float = 0.05,
+    invisible: float = 0.3,
+    seed: int = 1,
+):
+    """
+    Write n_messages messages in DATE_FORMATS[fmt_idx] layout. multiline is
+    the chance of each extra continuation line, attach the share of image
+    messages, invisible the share of senders wrapped in direction marks.
+    Returns (lines written, attachment filenames).
+    """
+    rnd = random.Random(seed)
+    dt = datetime(2023, 1, 1, 9, 0, 0)
+    lines = 0
+    attachments = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n_messages):
+            dt += timedelta(seconds=rnd.randint(1, 600))
+            date = dt.strftime(SYNTH_FORMATS[fmt_idx])
+            ampm = "PM" if dt.hour >= 12 else "AM"
+            # newer exports put a narrow no-break space before AM/PM
+            stamp = f"{date}, {dt.hour % 12 or 12}:{dt:%M:%S}\u202f{ampm}"
+            sender = rnd.choice(SENDERS)
+            if rnd.random() < invisible:
+                sender = rnd.choice(INVISIBLE) + sender + rnd.choice(INVISIBLE)
+            if rnd.random() < attach:
+                fname = f"{i:08d}-PHOTO.jpg"
+                attachments.append(fname)
+                text = f"\u200e<attached: {fname}>"
+            else:
+                text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 12)))
+            f.write(f"[{stamp}] {sender}: {text}\n")
+            lines += 1
+            while rnd.random() < multiline:
+                f.write("  continued " + rnd.choice(WORDS) + "\n")
+                lines += 1
+    return lines, attachments
+
+
+def write_images(media_dir: str, filenames, distinct: int = 50, seed: int = 1):
+    """
+    Write an image with a few lines of text for each filename. Only distinct
+    different pictures are drawn; the rest are copies, like forwarded photos.
+    """
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    os.makedirs(media_dir, exist_ok=True)
+    originals = []
+    for n, fname in enumerate(filenames):
+        path = os.path.join(media_dir, fname)
+        if n >= distinct:
+            shutil.copyfile(rnd.choice(originals), path)
+            continue
+        img = Image.new("RGB", (640, 360), "white")
+        draw = ImageDraw.Draw(img)
+        for row in range(6):
+            words = [rnd.choice(IMAGE_WORDS) for _ in range(rnd.randint(2, 5))]
+            words.append(str(rnd.randint(100, 99999)))
+            draw.text((24, 24 + row * 52), " ".join(words).upper(), fill="black")
+        img.save(path, format="JPEG", quality=90)
+        originals.append(path)
+
+
+def write_export(
+    chat_dir: str, n_messages: int, images: bool = True, distinct: int = 50, **kw
+):
+    """Write chat_dir/_chat.txt and, with images, chat_dir/Media/. Returns stats."""
+    os.makedirs(os.path.join(chat_dir, "Media"), exist_ok=True)
+    chat_file = os.path.join(chat_dir, "_chat.txt")
+    lines, attachments = write_chat_txt(chat_file, n_messages, **kw)
+    if images:
+        media_dir = os.path.join(chat_dir, "Media")
+        write_images(media_dir, attachments, distinct, kw.get("seed", 1))
+    return {
+        "messages": n_messages,
+        "lines": lines,
+        "bytes": os.path.getsize(chat_file),
+        "attachments": len(attachments),
+        "images": len(attachments) if images else 0,
+    }
+
+
+def add_export_args(ap):
+    ap.add_argument("--messages", type=int, default=100_000)
+    ap.add_argument("--date-format", type=int, default=0, choices=range(4))
+    ap.add_argument("--multiline", type=float, default=0.1, help="continuation chance")
+    ap.add_argument("--attach", type=float, default=0.05, help="share of images")
+    ap.add_argument("--invisible", type=float, default=0.3, help="marked sender share")
+    ap.add_argument("--images", action="store_true", help="write images with text")
+    ap.add_argument("--distinct-images", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=1)
+
+
+def export_kwargs(args):
+    return {
+        "images": args.images,
+        "distinct": args.distinct_images,
+        "fmt_idx": args.date_format,
+        "multiline": args.multiline,
+        "attach": args.attach,
+        "invisible": args.invisible,
+        "seed": args.seed,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("out_dir", help="chat folder to create, e.g. chats/Synthetic")
+    add_export_args(ap)
+    args = ap.parse_args()
+    stats = write_export(args.out_dir, args.messages, **export_kwargs(args))
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
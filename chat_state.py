@@ -1,34 +1,341 @@
+from collections import OrderedDict
 import os
+import sys
+import threading
+import time
 
 import config
+import highlight
 import parsing
+import ocr_store
 import ocr_utils
+import meta_db
+import metrics
+import search_index
+import snapshot
+import time_index
 
 
 class ChatState:
-    def __init__(self, chat_id: str, base_dir: str):
+    def __init__(self, chat_id: str, base_dir: str, ocr_mode=None):
         self.chat_id = chat_id
         self.base_dir = base_dir
         self.chat_file = os.path.join(base_dir, "_chat.txt")
         self.media_dir = os.path.join(base_dir, "Media")
         self.messages = []
-        self.image_ocr = {}
-        self.image_boxes = {}
+        self.attachments = []  # unique attachment filenames, in chat order
+        self.image_ocr = ocr_store.OcrTextMap()
+        self.image_boxes = ocr_store.BoxMap(self.image_ocr)
+        self.search_index = search_index.ChatSearchIndex(self)
+        self.html_cache = highlight.HtmlCache()
+        self.html_bytes_counted = 0  # html_cache.bytes at the last estimate_size
+        self.time_index = time_index.TimeIndex(self.messages)
+        self.source = None  # snapshot.source_info of the parsed _chat.txt
+        self.tail_offset = 0  # byte offset of the last message's first line
+        self.fmt_idx = None  # parsing.DATE_FORMATS index in use at tail_offset
+        self.ocr_synced_at = 0  # newest stored OCR result applied (updated_at)
+        self.checked_at = time.time()
+        # "background": OCR new images in a thread, "foreground": OCR them
+        # before returning (the indexer), "cached": apply stored results only
+        self.ocr_mode = ocr_mode or config.WEB_OCR_MODE
 
     def load(self):
         if not os.path.exists(self.chat_file):
             print(f"[{self.chat_id}] _chat.txt not found at {self.chat_file}")
             return
-        self.messages = parsing.parse_chat(self.chat_file)
-        print(f"[{self.chat_id}] Loaded {len(self.messages)} messages.")
 
-        if os.path.isdir(self.media_dir) and ocr_utils.OCR_AVAILABLE:
-            ocr_utils.build_image_ocr_index_for_chat(self)
+        snap_path = snapshot.snapshot_path(self.chat_id)
+        with metrics.phase("snapshot_load"):
+            snap = snapshot.load(self.chat_file, snap_path, prefix_ok=True)
+        if snap is not None:
+            self.source, snap = snap
+            self.messages = snap["messages"]
+            self.attachments = snap["attachments"]
+            self.tail_offset = snap["tail_offset"]
+            self.fmt_idx = snap["fmt_idx"]
+            print(f"[{self.chat_id}] Loaded {len(self.messages)} messages from snapshot.")
+        else:
+            with metrics.phase("parse"):
+                self.messages, self.tail_offset, end, self.fmt_idx = (
+                    parsing.parse_chat_from(self.chat_file)
+                )
+                self.attachments = unique_attachments(self.messages)
+            self.source = snapshot.source_info(self.chat_file)
+            if self.source["size"] != end:
+                # written to while parsing: make the next refresh reload
+                self.source["hash"] = None
+            print(f"[{self.chat_id}] Loaded {len(self.messages)} messages.")
+        with metrics.phase("time_index"):
+            self.time_index = time_index.TimeIndex(self.messages)
+
+        # stored results apply without Tesseract
+        ocr_usable = ocr_utils.OCR_AVAILABLE or self.ocr_mode == "cached"
+        if os.path.isdir(self.media_dir) and ocr_usable:
+            with metrics.phase("ocr"):
+                # results stored from here on are applied by sync_stored_ocr
+                self.ocr_synced_at = ocr_store.last_update(self.chat_id)
+                self.run_ocr()
         else:
             print(f"[{self.chat_id}] Media dir missing or OCR disabled; skipping OCR.")
 
+        with metrics.phase("search_index"):
+            self.build_search_index(snap["search_base"] if snap is not None else None)
+
+        if snap is None:
+            with metrics.phase("snapshot_save"):
+                self.save_snapshot()
+        elif self.source["size"] != os.path.getsize(self.chat_file):
+            # snapshot of an earlier export this one appended to
+            with metrics.phase("refresh"):
+                self.refresh()
+
+    def run_ocr(self, filenames=None):
+        ocr_utils.build_image_ocr_index_for_chat(
+            self,
+            filenames,
+            background=self.ocr_mode == "background",
+            resolve=self.ocr_mode != "cached",
+        )
+
+    def sync_stored_ocr(self) -> bool:
+        """
+        Apply results the indexer has stored since the chat was loaded
+        ("cached" mode), for files that still match them: new files, and
+        files re-OCR'd since (e.g. after an outdated result was redone).
+        Returns True if any were new.
+        """
+        applied = 0
+        synced_at = self.ocr_synced_at
+        for fname, (content_hash, mtime, size, updated_at) in (
+            ocr_store.get_chat_hashes(self.chat_id).items()
+        ):
+            self.ocr_synced_at = max(self.ocr_synced_at, updated_at)
+            if (
+                self.image_ocr.hashes.get(fname) == content_hash
+                and updated_at <= synced_at
+            ):
+                continue
+            try:
+                st = os.stat(os.path.join(self.media_dir, fname))
+            except OSError:
+                continue
+            if st.st_mtime != mtime or st.st_size != size:
+                continue
+            text = ocr_store.get_text(content_hash)
+            if text is None:
+                continue
+            self.image_ocr.set(fname, content_hash, text)
+            self.search_index.update_ocr(fname)
+            applied += 1
+        if applied:
+            print(f"[{self.chat_id}] Applied {applied} OCR results stored since load.")
+        return applied > 0
+
+    def estimate_size(self) -> int:
+        """
+        Rough resident size in bytes: messages (sampled), OCR text, the
+        search index and the escaped HTML cache, which grows as pages are
+        viewed (see get_chat_state). OCR boxes are read from the OCR store
+        per request and are not held here.
+        """
+        getsizeof = sys.getsizeof
+        messages = self.messages
+        n = len(messages)
+        total = getsizeof(messages)
+        if n:
+            step = max(1, n // 2000)
+            sample = messages[::step]
+            per_msg = sum(
+                getsizeof(m) + getsizeof(m.text) + getsizeof(m.datetime) + getsizeof(m.attachments)
+                for m in sample
+            ) / len(sample)
+            total += int(per_msg * n)
+        total += sum(getsizeof(t) for t in self.image_ocr.texts.values())
+        total += getsizeof(self.image_ocr.texts) + getsizeof(self.image_ocr.hashes)
+        total += self.search_index.estimate_size()
+        self.html_bytes_counted = self.html_cache.bytes
+        total += self.html_bytes_counted
+        return total
+
+    def save_snapshot(self):
+        snapshot.save(
+            snapshot.snapshot_path(self.chat_id),
+            self.source,
+            {
+                "messages": self.messages,
+                "attachments": self.attachments,
+                "tail_offset": self.tail_offset,
+                "fmt_idx": self.fmt_idx,
+                "search_base": self.search_index.base_state(),
+            },
+        )
+
+    def refresh(self) -> bool:
+        """
+        Bring the chat up to date with _chat.txt. A file that only grew (its
+        old bytes hash the same) is parsed from the last message on and
+        appended in place. Returns False when the file was replaced or removed
+        and the chat has to be reloaded from scratch.
+        """
+        self.checked_at = time.time()
+        src = self.source
+        try:
+            st = os.stat(self.chat_file)
+        except OSError:
+            return False
+        if src is None or src["hash"] is None:
+            return False
+        if st.st_size == src["size"] and st.st_mtime == src["mtime"]:
+            return True
+        if st.st_size < src["size"]:
+            return False
+        if snapshot.file_digest(self.chat_file, src["size"]) != src["hash"]:
+            return False
+        if st.st_size == src["size"]:
+            src["mtime"] = st.st_mtime  # touched, not changed
+            return True
+        self._append_tail()
+        return True
+
+    def _append_tail(self):
+        messages, tail_offset, end, self.fmt_idx = parsing.parse_chat_from(
+            self.chat_file, self.tail_offset, self.fmt_idx
+        )
+        # the old last message is parsed again, since new lines may continue it
+        old_count = len(self.messages)
+        first = max(old_count - 1, 0)
+        with self.search_index.lock:
+            self.messages[first:] = messages
+            self.search_index.extend(first)
+        self.time_index = time_index.TimeIndex(self.messages)
+        known = set(self.attachments)
+        new_files = []
+        for msg in messages:
+            for fname in msg.attachments:
+                if fname not in known:
+                    known.add(fname)
+                    new_files.append(fname)
+        self.attachments.extend(new_files)
+        self.tail_offset = tail_offset
+        self.source = snapshot.source_info(self.chat_file)
+        if self.source["size"] != end:
+            self.source["hash"] = None
+        print(
+            f"[{self.chat_id}] Appended {len(self.messages) - old_count} messages, "
+            f"{len(new_files)} new attachments."
+        )
+
+        ocr_usable = ocr_utils.OCR_AVAILABLE or self.ocr_mode == "cached"
+        if new_files and os.path.isdir(self.media_dir) and ocr_usable:
+            self.run_ocr(new_files)
+        self.save_snapshot()
+
+    def build_search_index(self, base=None):
+        notes = meta_db.get_chat_notes(self.chat_id)
+        self.search_index.build(notes, base)
+        print(f"[{self.chat_id}] Search index built.")
+
+
+def unique_attachments(messages):
+    seen = set()
+    out = []
+    for msg in messages:
+        for fname in msg.attachments:
+            if fname not in seen:
+                seen.add(fname)
+                out.append(fname)
+    return out
+
+
+class ChatCache:
+    """
+    LRU of loaded ChatStates bounded by their estimated size. The least
+    recently used chats are dropped once the total exceeds budget bytes
+    (the newest chat is always kept); they are reloaded on the next request,
+    usually from their snapshot.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.chats = OrderedDict()  # chat_id -> ChatState, oldest first
+        self.sizes = {}  # chat_id -> estimated bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-CHATS = {}  # chat_id -> ChatState
+    def get(self, chat_id: str):
+        with self.lock:
+            chat = self.chats.get(chat_id)
+            if chat is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.chats.move_to_end(chat_id)
+            return chat
+
+    def peek(self, chat_id: str):
+        """Cached chat without touching the LRU order or the counters."""
+        with self.lock:
+            return self.chats.get(chat_id)
+
+    def put(self, chat_id: str, chat):
+        size = chat.estimate_size()
+        with self.lock:
+            self._discard(chat_id)
+            self.chats[chat_id] = chat
+            self.sizes[chat_id] = size
+            self.bytes += size
+            self._evict()
+
+    def resize(self, chat_id: str):
+        """Re-estimate a cached chat after it grew."""
+        with self.lock:
+            chat = self.chats.get(chat_id)
+        if chat is None:
+            return
+        size = chat.estimate_size()
+        with self.lock:
+            if self.chats.get(chat_id) is chat:
+                self.bytes += size - self.sizes[chat_id]
+                self.sizes[chat_id] = size
+                self._evict()
+
+    def pop(self, chat_id: str):
+        with self.lock:
+            self._discard(chat_id)
+        meta_db.forget(chat_id)
+
+    def _discard(self, chat_id):
+        if self.chats.pop(chat_id, None) is not None:
+            self.bytes -= self.sizes.pop(chat_id)
+
+    def _evict(self):
+        while self.bytes > self.budget and len(self.chats) > 1:
+            chat_id, _ = self.chats.popitem(last=False)
+            self.bytes -= self.sizes.pop(chat_id)
+            self.evictions += 1
+            meta_db.forget(chat_id)
+            print(f"[{chat_id}] Evicted from the chat cache.")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "budget_bytes": self.budget,
+                "bytes": self.bytes,
+                "chats": len(self.chats),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": [
+                    {"chat_id": chat_id, "bytes": self.sizes[chat_id]}
+                    for chat_id in reversed(self.chats)
+                ],
+            }
+
+
+CHATS = ChatCache(config.CHAT_CACHE_MB * 1024 * 1024)
 
 
 def discover_chats():
@@ -45,15 +352,68 @@ def discover_chats():
     return chats
 
 
+_LOAD_LOCKS = {}  # chat_id -> lock held while loading or refreshing it
+_LOAD_LOCKS_GUARD = threading.Lock()
+
+
+def _load_lock(chat_id: str):
+    with _LOAD_LOCKS_GUARD:
+        lock = _LOAD_LOCKS.get(chat_id)
+        if lock is None:
+            lock = _LOAD_LOCKS[chat_id] = threading.Lock()
+        return lock
+
+
 def get_chat_state(chat_id: str):
+    """
+    Loaded ChatState for chat_id, or None. Safe to call from many threads:
+    concurrent callers for a chat that is not loaded wait for one load.
+    Cached chats are checked against their _chat.txt at most every
+    RELOAD_CHECK_INTERVAL seconds: appended messages are picked up in place,
+    a replaced file reloads the chat.
+    """
     if not chat_id:
         return None
-    if chat_id in CHATS:
-        return CHATS[chat_id]
+    chat = CHATS.get(chat_id)
+    if chat is not None and time.time() - chat.checked_at < config.RELOAD_CHECK_INTERVAL:
+        return chat
     base_dir = os.path.join(config.CHAT_ROOT, chat_id)
     if not os.path.isdir(base_dir):
         return None
-    chat = ChatState(chat_id, base_dir)
-    chat.load()
-    CHATS[chat_id] = chat
-    return chat
+
+    with _load_lock(chat_id):
+        # another thread may have loaded or refreshed it while we waited
+        chat = CHATS.peek(chat_id)
+        if chat is not None:
+            if time.time() - chat.checked_at < config.RELOAD_CHECK_INTERVAL:
+                return chat
+            size = chat.source and chat.source["size"]
+            with metrics.phase("refresh"):
+                fresh = chat.refresh()
+                # in "cached" mode the indexer may have OCR'd more images
+                synced = False
+                if fresh and chat.ocr_mode == "cached":
+                    synced = chat.sync_stored_ocr()
+            if fresh:
+                grown = chat.source and chat.source["size"] != size
+                html_grown = chat.html_cache.bytes != chat.html_bytes_counted
+                if synced or grown or html_grown:
+                    CHATS.resize(chat_id)
+                return chat
+            print(f"[{chat_id}] _chat.txt changed; reloading.")
+            CHATS.pop(chat_id)
+        chat = ChatState(chat_id, base_dir)
+        chat.load()
+        CHATS.put(chat_id, chat)
+        return chat
+
+
+def resume_queued_ocr():
+    """
+    Load each chat with OCR jobs left in the queue by an earlier run, which
+    restarts its runner. Meant for a background thread at startup.
+    """
+    for chat_id in ocr_store.queued_chats():
+        if os.path.isdir(os.path.join(config.CHAT_ROOT, chat_id)):
+            print(f"[{chat_id}] Resuming queued OCR.")
+            get_chat_state(chat_id)
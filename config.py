@@ -1,9 +1,107 @@
+import os
+
 # Where your chat folders live (each with _chat.txt + Media/)
 CHAT_ROOT = "chats"
 
 # Files for OCR + image meta
-OCR_CACHE_FILE = "image_ocr_cache_multi.json"
+OCR_DB_PATH = "image_ocr.db"
 DB_PATH = "image_meta.db"
 
+# Parsed-chat snapshots, reused until the chat's _chat.txt changes
+SNAPSHOT_DIR = ".snapshots"
+
+# Per-chat message shards for cross-chat search (/search), and how many
+# chats are searched at once
+SEARCH_SHARD_DIR = ".search"
+SEARCH_WORKERS = 4
+
+# Seconds between checks of a loaded chat's _chat.txt for appended messages
+# or a replaced export
+RELOAD_CHECK_INTERVAL = 2
+
+# Memory budget (MB, estimated) for loaded chats; least recently used chats
+# beyond it are dropped and reloaded on demand
+CHAT_CACHE_MB = 1024
+
+# How the web app OCRs images it has no stored result for: "background"
+# (in a thread after the chat opens) or "cached" (never; leave it to
+# `python -m indexer`)
+WEB_OCR_MODE = "background"
+
+# `python -m indexer`: chats indexed at once, seconds between --watch scans
+INDEX_WORKERS = 2
+INDEX_WATCH_INTERVAL = 10
+
+# Send the chat page as it renders instead of building it whole first, in
+# chunks of STREAM_CHUNK template pieces
+STREAM_PAGES = True
+STREAM_CHUNK = 64
+
+# Escaped message / OCR / note HTML kept per loaded chat (entries), so
+# pages and scrolling don't re-escape the same text
+HTML_CACHE_ENTRIES = 20000
+
+# Thumbnails: longest side in px per size name, preferred format ("webp",
+# served as JPEG to clients without WebP support), quality, worker processes,
+# on-disk cache keyed by image content hash, and browser cache lifetime
+THUMB_SIZES = {"small": 160, "medium": 480}
+THUMB_FORMAT = "webp"
+THUMB_QUALITY = 80
+THUMB_WORKERS = 2
+THUMB_DIR = ".thumbs"
+THUMB_MAX_AGE = 86400
+
+# Request instrumentation: per-phase timers behind the Server-Timing header
+# and /metrics. PROFILE_REQUESTS writes a cProfile dump (.prof, open with
+# snakeviz or pstats) to PROFILE_DIR for each request slower than
+# PROFILE_MIN_SECONDS; it slows requests down, so leave it off normally.
+METRICS_ENABLED = True
+PROFILE_REQUESTS = False
+PROFILE_DIR = ".profiles"
+PROFILE_MIN_SECONDS = 0.0
+
+# Legacy JSON OCR cache, imported into OCR_DB_PATH once if present
+OCR_CACHE_FILE = "image_ocr_cache_multi.json"
+
 # Your name as it appears in the WhatsApp export
 SELF_NAME = "Sohel Shekh"
+
+# Messages rendered per window on the chat page / returned by the JSON API
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+# OCR worker pool: processes, max images queued/in flight, seconds per image
+OCR_WORKERS = os.cpu_count() or 1
+OCR_QUEUE_SIZE = OCR_WORKERS * 4
+OCR_TIMEOUT = 60
+
+# Images waiting for OCR are queued in OCR_DB_PATH, so a stopped app or
+# indexer picks up where it left off; each gets this many tries before it
+# is marked failed (see /api/chats/<id>/ocr_status for the errors)
+OCR_MAX_ATTEMPTS = 3
+
+# Images are OCR'd as grayscale, scaled down to at most OCR_MAX_SIDE px.
+# With OCR_FAST_REJECT, images that look text-free skip Tesseract: a 512px
+# copy with a pixel stddev under OCR_MIN_CONTRAST (flat pictures) or fewer
+# than OCR_MIN_EDGE_DENSITY of its pixels on an edge stronger than
+# OCR_EDGE_LEVEL (0-255; smooth photos). Busy photos are still OCR'd; raise
+# the density to skip more, at the risk of missing sparse text.
+OCR_MAX_SIDE = 2500
+OCR_FAST_REJECT = True
+OCR_MIN_CONTRAST = 2
+OCR_EDGE_LEVEL = 32
+OCR_MIN_EDGE_DENSITY = 0.004
+
+# Tesseract passes: language sets ("eng", "hin+guj+eng", ...; each needs its
+# traineddata installed) and page segmentation modes (3 automatic, 6 one text
+# block, 11 sparse text). The first set with the first mode always runs; the
+# other combinations are tried in order only while the best pass's mean word
+# confidence (0-100) is below OCR_MIN_CONFIDENCE, and the most confident pass
+# is kept, with each box's confidence stored for search ranking.
+OCR_LANGS = ["eng"]
+OCR_PSMS = [3, 11]
+OCR_MIN_CONFIDENCE = 60
+
+# Reuse OCR of perceptually identical images (recompressed copies). Off by
+# default: near-identical screenshots with different small text can collide.
+OCR_PHASH_DEDUP = False
@@ -0,0 +1,264 @@
+"""
+Search across every chat without loading them. Each chat's messages live in
+a per-chat SQLite shard (FTS5 trigram table, so any substring of three or
+more characters is an index lookup), kept in step with _chat.txt the same
+way ChatState is: appended bytes are parsed and added, a replaced export is
+re-indexed. OCR text and notes are queried from their own stores.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import sqlite3
+import threading
+
+import config
+import meta_db
+import ocr_store
+import parsing
+import snapshot
+
+# Bump when the shard layout or the parser output changes; older shards are
+# rebuilt
+SHARD_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS source (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT,
+    tail_offset INTEGER,
+    fmt_idx INTEGER,
+    count INTEGER
+);
+-- rowid is the message index into ChatState.messages
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    text, sender UNINDEXED, datetime UNINDEXED, tokenize = 'trigram'
+);
+CREATE TABLE IF NOT EXISTS files (filename TEXT, msg_idx INTEGER);
+CREATE INDEX IF NOT EXISTS files_name ON files(filename);
+"""
+
+# hits on notes / OCR text rank above plain message text; OCR hits are
+# further scaled by the Tesseract confidence (0-100) of the matched words
+KIND_WEIGHT = {"note": 3, "ocr": 2, "message": 1}
+
+_SYNC_LOCKS = {}  # chat_id -> lock held while its shard is updated
+_SYNC_LOCKS_GUARD = threading.Lock()
+
+
+def shard_path(chat_id: str) -> str:
+    name = hashlib.blake2b(chat_id.encode("utf-8"), digest_size=12).hexdigest()
+    return os.path.join(config.SEARCH_SHARD_DIR, name + ".db")
+
+
+def _sync_lock(chat_id: str):
+    with _SYNC_LOCKS_GUARD:
+        lock = _SYNC_LOCKS.get(chat_id)
+        if lock is None:
+            lock = _SYNC_LOCKS[chat_id] = threading.Lock()
+        return lock
+
+
+def open_shard(chat_id: str):
+    os.makedirs(config.SEARCH_SHARD_DIR, exist_ok=True)
+    conn = sqlite3.connect(shard_path(chat_id), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def sync_shard(chat_id: str, chat_file: str):
+    """
+    Bring chat_id's shard up to date with chat_file and return an open
+    connection to it. Only appended bytes are parsed when the file grew.
+    """
+    with _sync_lock(chat_id):
+        conn = open_shard(chat_id)
+        st = os.stat(chat_file)
+        src = conn.execute("SELECT * FROM source").fetchone()
+        if src is not None and src["version"] == SHARD_VERSION:
+            if src["size"] == st.st_size and src["mtime"] == st.st_mtime:
+                return conn
+            if st.st_size >= src["size"] and src["hash"] == snapshot.file_digest(
+                chat_file, src["size"]
+            ):
+                _index_tail(
+                    conn, chat_file, src["tail_offset"], src["count"], src["fmt_idx"]
+                )
+                return conn
+        _index_tail(conn, chat_file, 0, 0)
+        return conn
+
+
+def _index_tail(conn, chat_file: str, start: int, count: int, fmt_idx=None):
+    """
+    Index the messages parsed from byte offset start, re-adding the last.
+    fmt_idx is the date format in use there (see parsing.parse_chat_from).
+    """
+    messages, tail_offset, end, fmt_idx = parsing.parse_chat_from(
+        chat_file, start, fmt_idx
+    )
+    first = max(count - 1, 0) if start else 0
+    source = snapshot.source_info(chat_file)
+    if source["size"] != end:
+        source["hash"] = None  # written to while parsing; rebuild next time
+    with conn:
+        conn.execute("DELETE FROM messages WHERE rowid >= ?", (first,))
+        conn.execute("DELETE FROM files WHERE msg_idx >= ?", (first,))
+        conn.executemany(
+            "INSERT INTO messages (rowid, text, sender, datetime) VALUES (?, ?, ?, ?)",
+            (
+                (
+                    idx,
+                    f"{msg.sender} {msg.text}",
+                    msg.sender,
+                    msg.datetime.isoformat() if msg.datetime else None,
+                )
+                for idx, msg in enumerate(messages, first)
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO files (filename, msg_idx) VALUES (?, ?)",
+            (
+                (fname, idx)
+                for idx, msg in enumerate(messages, first)
+                for fname in msg.attachments
+            ),
+        )
+        conn.execute("DELETE FROM source")
+        conn.execute(
+            "INSERT INTO source "
+            "(id, version, size, mtime, hash, tail_offset, fmt_idx, count) "
+            "VALUES (0, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                SHARD_VERSION,
+                source["size"],
+                source["mtime"],
+                source["hash"],
+                tail_offset,
+                fmt_idx,
+                first + len(messages),
+            ),
+        )
+
+
+def _phrase(q: str) -> str:
+    return '"' + q.replace('"', '""') + '"'
+
+
+def _snippet(text: str, q: str, width: int = 60) -> str:
+    at = text.lower().find(q)
+    if at < 0:
+        return text[: width * 2]
+    start = max(0, at - width)
+    return ("…" if start else "") + text[start : at + len(q) + width]
+
+
+def search_shard(chat, q: str, file_hits):
+    """
+    Hits for one chat: message text from its shard, plus the OCR / note
+    hits in file_hits ({filename: [(kind, text, conf)]}) mapped to messages.
+    """
+    conn = sync_shard(chat["id"], os.path.join(chat["path"], "_chat.txt"))
+    try:
+        if len(q) >= 3:
+            rows = conn.execute(
+                "SELECT rowid, text, sender, datetime FROM messages WHERE messages MATCH ?",
+                (_phrase(q),),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT rowid, text, sender, datetime FROM messages "
+                "WHERE text LIKE ? ESCAPE '\\'",
+                (ocr_store.like_pattern(q),),
+            ).fetchall()
+        hits = []
+        for row in rows:
+            text = row["text"]
+            # the tokenizer folds ASCII case only; keep search_index semantics
+            n = text.lower().count(q)
+            if n:
+                hits.append(_hit(chat["id"], row, "message", None, text, q, n))
+
+        for filename, matches in file_hits.items():
+            row = conn.execute(
+                "SELECT m.rowid, m.text, m.sender, m.datetime FROM files f "
+                "JOIN messages m ON m.rowid = f.msg_idx "
+                "WHERE f.filename = ? ORDER BY f.msg_idx LIMIT 1",
+                (filename,),
+            ).fetchone()
+            if row is None:
+                continue
+            for kind, text, conf in matches:
+                n = text.lower().count(q)
+                if n:
+                    hits.append(
+                        _hit(chat["id"], row, kind, filename, text, q, n, conf)
+                    )
+        return hits
+    finally:
+        conn.close()
+
+
+def _hit(chat_id, row, kind, filename, text, q, n, conf=None):
+    score = n * KIND_WEIGHT[kind]
+    if conf is not None:
+        score = round(score * conf / 100, 2)
+    return {
+        "chat_id": chat_id,
+        "msg_idx": row["rowid"],
+        "kind": kind,
+        "filename": filename,
+        "sender": row["sender"],
+        "datetime": row["datetime"],
+        "snippet": _snippet(text, q),
+        "score": score,
+        "confidence": conf,
+    }
+
+
+def search(q: str, chats, limit: int = 50):
+    """
+    Search every chat in chats (as from chat_state.discover_chats) for the
+    lower-cased query q, one shard per worker thread. Returns (hits ranked
+    by score then newest first, {chat_id: hit count}).
+    """
+    if not q:
+        return [], {}
+    known = {c["id"] for c in chats}
+    file_hits = {}  # chat_id -> {filename: [(kind, text, conf)]}
+    for chat_id, filename, text, conf in ocr_store.search_text(q):
+        if chat_id in known:
+            file_hits.setdefault(chat_id, {}).setdefault(filename, []).append(
+                ("ocr", text, conf)
+            )
+    for chat_id, filename, note in meta_db.search_notes(q):
+        if chat_id in known:
+            file_hits.setdefault(chat_id, {}).setdefault(filename, []).append(
+                ("note", note, None)
+            )
+
+    hits = []
+    counts = {}
+    with ThreadPoolExecutor(max_workers=config.SEARCH_WORKERS) as pool:
+        futures = {
+            c["id"]: pool.submit(search_shard, c, q, file_hits.get(c["id"], {}))
+            for c in chats
+        }
+        for chat_id, future in futures.items():
+            try:
+                chat_hits = future.result()
+            except Exception as e:
+                print(f"[{chat_id}] Global search failed: {e}")
+                continue
+            if chat_hits:
+                counts[chat_id] = len(chat_hits)
+                hits.extend(chat_hits)
+
+    hits.sort(key=lambda h: h["datetime"] or "", reverse=True)
+    hits.sort(key=lambda h: h["score"], reverse=True)
+    return hits[:limit], counts
@@ -0,0 +1,103 @@
+"""
+Search highlighting for the chat page and the messages API. The query is
+compiled once per request, spans are found on the raw text and the text is
+escaped around them, so a query can't match inside an HTML entity. Text
+without a match is served from a per-chat cache of escaped HTML.
+"""
+
+import html
+import re
+import sys
+import threading
+
+import config
+
+
+class Highlighter:
+    """Highlights one query (case-insensitive); build one per request."""
+
+    def __init__(self, q_raw: str, cache=None):
+        self.pattern = re.compile(re.escape(q_raw), re.IGNORECASE) if q_raw else None
+        self.cache = cache
+
+    def spans(self, text: str):
+        """[(start, end)] of non-overlapping matches in text."""
+        if self.pattern is None or not text:
+            return []
+        return [m.span() for m in self.pattern.finditer(text)]
+
+    def escape(self, kind: str, key, text: str) -> str:
+        """Escaped text, from the cache when it holds this text for (kind, key)."""
+        if self.cache is None:
+            return html.escape(text)
+        return self.cache.get(kind, key, text)
+
+    def render(self, kind: str, key, text: str, spans=None) -> str:
+        """
+        text as HTML with spans (found here when not given) wrapped in
+        <span class="hl">. Returns "" for empty text.
+        """
+        if not text:
+            return ""
+        if spans is None:
+            spans = self.spans(text)
+        if not spans:
+            return self.escape(kind, key, text)
+        parts = []
+        pos = 0
+        for start, end in spans:
+            parts.append(html.escape(text[pos:start]))
+            parts.append(f'<span class="hl">{html.escape(text[start:end])}</span>')
+            pos = end
+        parts.append(html.escape(text[pos:]))
+        return "".join(parts)
+
+
+class HtmlCache:
+    """
+    Escaped HTML for one chat's message text ("msg", index), OCR text
+    ("ocr", filename) and notes ("note", filename), oldest dropped beyond
+    max_entries. Each entry keeps the text it was made from and is only
+    used for that same text, so re-parsed messages and new OCR results
+    never get stale HTML. Short text is cheaper to escape than to look up
+    and isn't cached.
+    """
+
+    MIN_LENGTH = 200
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or config.HTML_CACHE_ENTRIES
+        self.entries = {}  # (kind, key) -> (text, html), insertion ordered
+        self.lock = threading.Lock()  # writers only; reads are single dict gets
+        # estimated bytes of the cached HTML; the text is the message's own
+        self.bytes = 0
+
+    def get(self, kind: str, key, text: str) -> str:
+        if len(text) < self.MIN_LENGTH:
+            return html.escape(text)
+        k = (kind, key)
+        entry = self.entries.get(k)
+        if entry is not None and (entry[0] is text or entry[0] == text):
+            return entry[1]
+        escaped = html.escape(text)
+        with self.lock:
+            self._drop(k)
+            self.entries[k] = (text, escaped)
+            self.bytes += _entry_size(escaped)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+        return escaped
+
+    def invalidate(self, kind: str, key):
+        with self.lock:
+            self._drop((kind, key))
+
+    def _drop(self, k):
+        entry = self.entries.pop(k, None)
+        if entry is not None:
+            self.bytes -= _entry_size(entry[1])
+
+
+def _entry_size(escaped: str) -> int:
+    # the HTML string, its entry tuple and key, and a dict slot
+    return sys.getsizeof(escaped) + 200
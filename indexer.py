@@ -0,0 +1,176 @@
+"""
+Build chat snapshots, OCR results, search shards and (optionally)
+thumbnails ahead of the web app, and keep them current as exports change.
+
+    python -m indexer index --all [--workers N] [--thumbs] [--watch]
+    python -m indexer index "Chat folder" ...
+
+Run it with the same config.py (and working directory) as the web app. Set
+WEB_OCR_MODE = "cached" there to leave all OCR to the indexer.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import config
+import chat_state
+import global_search
+import ocr_utils
+import parsing
+import thumbnails
+
+
+def index_chat(chat_id: str, ocr_workers: int, thumbs: bool):
+    """Load one chat with OCR in the foreground, then build its other artifacts."""
+    # each chat gets its own OCR pool, sized so the chats together fit the CPUs
+    config.OCR_WORKERS = ocr_workers
+    config.OCR_QUEUE_SIZE = ocr_workers * 4
+    started = time.time()
+    base_dir = os.path.join(config.CHAT_ROOT, chat_id)
+    chat = chat_state.ChatState(chat_id, base_dir, ocr_mode="foreground")
+    try:
+        chat.load()
+    finally:
+        # a worker process can't exit while its own pool is still up
+        ocr_utils.shutdown_pool()
+    global_search.sync_shard(chat_id, chat.chat_file).close()
+    thumb_count = build_thumbnails(chat) if thumbs else 0
+    progress = ocr_utils.get_progress(chat_id)
+    return {
+        "chat_id": chat_id,
+        "messages": len(chat.messages),
+        "ocr_done": progress.get("done", 0),
+        "ocr_failed": progress.get("failed", 0),
+        "thumbnails": thumb_count,
+        "seconds": round(time.time() - started, 2),
+    }
+
+
+def build_thumbnails(chat):
+    """Render missing thumbnails in this process; chats already run in parallel."""
+    if not thumbnails.THUMBS_AVAILABLE or not os.path.isdir(chat.media_dir):
+        return 0
+    fmt = thumbnails.pick_format(True)
+    count = 0
+    for fname in chat.attachments:
+        if not fname.lower().endswith(parsing.IMAGE_EXTS):
+            continue
+        path = os.path.join(chat.media_dir, fname)
+        try:
+            digest = thumbnails.content_hash(path, os.stat(path))
+            for size, max_px in config.THUMB_SIZES.items():
+                dst = thumbnails.thumb_path(digest, size, fmt)
+                if not os.path.exists(dst):
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    thumbnails.make_thumbnail(path, dst, max_px, fmt)
+            count += 1
+        except Exception as e:
+            print(f"[{chat.chat_id}] Thumbnail failed for {fname}: {e}")
+    return count
+
+
+def fingerprint(chat):
+    """Stats that change when a chat's export or media is replaced or added to."""
+    stats = []
+    for name in ("_chat.txt", "Media"):
+        path = os.path.join(chat["path"], name)
+        try:
+            st = os.stat(path)
+            stats.append((st.st_size, st.st_mtime))
+        except OSError:
+            stats.append(None)
+    return tuple(stats)
+
+
+def run(chat_ids, workers: int, thumbs: bool):
+    """Index chat_ids, workers chats at a time, each in its own process."""
+    if not chat_ids:
+        return []
+    workers = max(1, min(workers, len(chat_ids)))
+    ocr_workers = max(1, (os.cpu_count() or 1) // workers)
+    results = []
+    # spawn, so children open their own SQLite connections
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = {
+            pool.submit(index_chat, chat_id, ocr_workers, thumbs): chat_id
+            for chat_id in chat_ids
+        }
+        for future in as_completed(futures):
+            chat_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[{chat_id}] Indexing failed: {e}")
+                continue
+            results.append(result)
+            print(
+                f"[{chat_id}] Indexed {result['messages']} messages, "
+                f"{result['ocr_done']} images OCR'd ({result['ocr_failed']} failed), "
+                f"{result['thumbnails']} thumbnailed in {result['seconds']}s."
+            )
+    return results
+
+
+def watch(args):
+    """Re-index chats whose export or media changed, every --interval seconds."""
+    seen = {}
+    while True:
+        chats = chat_state.discover_chats()
+        if not args.all:
+            chats = [c for c in chats if c["id"] in args.chats]
+        changed = []
+        for chat in chats:
+            fp = fingerprint(chat)
+            if seen.get(chat["id"]) != fp:
+                changed.append(chat["id"])
+                seen[chat["id"]] = fp
+        if changed:
+            run(changed, args.workers, args.thumbs)
+        time.sleep(args.interval)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(
+        prog="python -m indexer", description=__doc__.strip().splitlines()[0]
+    )
+    sub = ap.add_subparsers(dest="command", required=True)
+    idx = sub.add_parser("index", help="build artifacts for chats under CHAT_ROOT")
+    idx.add_argument("chats", nargs="*", help="chat folder names")
+    idx.add_argument("--all", action="store_true", help="every chat under CHAT_ROOT")
+    idx.add_argument(
+        "--workers", type=int, default=config.INDEX_WORKERS, help="chats indexed at once"
+    )
+    idx.add_argument("--thumbs", action="store_true", help="also pre-render thumbnails")
+    idx.add_argument(
+        "--watch", action="store_true", help="keep running and re-index changed chats"
+    )
+    idx.add_argument(
+        "--interval",
+        type=float,
+        default=config.INDEX_WATCH_INTERVAL,
+        help="seconds between --watch scans",
+    )
+    args = ap.parse_args(argv)
+
+    if not args.all and not args.chats:
+        ap.error("name chats to index or pass --all")
+    if args.watch:
+        try:
+            watch(args)
+        except KeyboardInterrupt:
+            return 0
+    if args.all:
+        chat_ids = [c["id"] for c in chat_state.discover_chats()]
+    else:
+        chat_ids = args.chats
+    results = run(chat_ids, args.workers, args.thumbs)
+    return 0 if len(results) == len(chat_ids) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,12 @@
 import sqlite3
+import threading
 
 import config
 
-DB = sqlite3.connect(config.DB_PATH, check_same_thread=False)
+DB = sqlite3.connect(config.DB_PATH)
 DB.row_factory = sqlite3.Row
+# WAL lets request threads read while another thread writes
+DB.execute("PRAGMA journal_mode=WAL")
 
 DB.execute(
     """
@@ -14,33 +17,69 @@ CREATE TABLE IF NOT EXISTS image_meta (
     recorded INTEGER DEFAULT 0,
     not_found INTEGER DEFAULT 0,
     payment_record INTEGER DEFAULT 0,
-    note TEXT DEFAULT ''
+    note TEXT DEFAULT '',
+    chat_id TEXT,
+    fname TEXT
 )
 """
 )
+
+# filename holds the "chat_id::filename" key; chat_id / fname split it out so a
+# whole chat's meta is one indexed query. Older databases are backfilled here.
+_cols = {row["name"] for row in DB.execute("PRAGMA table_info(image_meta)")}
+if "chat_id" not in _cols:
+    DB.execute("ALTER TABLE image_meta ADD COLUMN chat_id TEXT")
+    DB.execute("ALTER TABLE image_meta ADD COLUMN fname TEXT")
+    DB.execute(
+        "UPDATE image_meta SET "
+        "chat_id = substr(filename, 1, instr(filename, '::') - 1), "
+        "fname = substr(filename, instr(filename, '::') + 2) "
+        "WHERE instr(filename, '::') > 0"
+    )
+DB.execute("CREATE INDEX IF NOT EXISTS image_meta_chat ON image_meta(chat_id)")
 DB.commit()
+DB.close()
+
+_LOCAL = threading.local()
+
+
+def connect():
+    """This thread's connection to DB_PATH, opened on first use."""
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(config.DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        _LOCAL.conn = conn
+    return conn
+
+
+# guards the cache only; queries run on per-thread connections outside it
+_LOCK = threading.Lock()
+_CHAT_CACHE = {}  # chat_id -> {filename: meta dict}
+_FLAG_CACHE = {}  # chat_id -> {status flag: set of filenames with it set}
+_VERSIONS = {}  # chat_id -> number of saves, to drop maps read before a save
+# SQLite serializes writers anyway; this keeps the cache in commit order
+_WRITE_LOCK = threading.Lock()
+
+
+STATUS_FLAGS = ["record_found", "recorded", "not_found", "payment_record"]
 
 
 def meta_key(chat_id: str, filename: str) -> str:
     return f"{chat_id}::{filename}"
 
 
-def get_image_meta(chat_id: str, filename: str):
-    key = meta_key(chat_id, filename)
-    cur = DB.execute(
-        "SELECT record_found, recorded, not_found, payment_record, note "
-        "FROM image_meta WHERE filename = ?",
-        (key,),
-    )
-    row = cur.fetchone()
-    if not row:
-        return {
-            "record_found": 0,
-            "recorded": 0,
-            "not_found": 0,
-            "payment_record": 0,
-            "note": "",
-        }
+def empty_meta():
+    return {
+        "record_found": 0,
+        "recorded": 0,
+        "not_found": 0,
+        "payment_record": 0,
+        "note": "",
+    }
+
+
+def _row_to_meta(row):
     return {
         "record_found": int(row["record_found"]),
         "recorded": int(row["recorded"]),
@@ -50,6 +89,86 @@ def get_image_meta(chat_id: str, filename: str):
     }
 
 
+def get_chat_meta(chat_id: str):
+    """
+    Return {filename: meta} for every image of a chat that has saved meta,
+    loaded with one query and cached until forget(chat_id). Files without
+    a row are absent; treat them as empty_meta(). Do not mutate the result,
+    and don't iterate it (save_image_meta adds to it); see get_chat_notes.
+    """
+    with _LOCK:
+        cached = _CHAT_CACHE.get(chat_id)
+        if cached is not None:
+            return cached
+        version = _VERSIONS.get(chat_id, 0)
+    rows = connect().execute(
+        "SELECT fname, record_found, recorded, not_found, payment_record, note "
+        "FROM image_meta WHERE chat_id = ?",
+        (chat_id,),
+    ).fetchall()
+    chat_meta = {row["fname"]: _row_to_meta(row) for row in rows}
+    with _LOCK:
+        cached = _CHAT_CACHE.get(chat_id)
+        if cached is not None:
+            return cached
+        if _VERSIONS.get(chat_id, 0) == version:
+            _CHAT_CACHE[chat_id] = chat_meta
+            _FLAG_CACHE[chat_id] = _flag_sets(chat_meta)
+        return chat_meta
+
+
+def get_chat_notes(chat_id: str):
+    """{filename: note} for a chat's images with saved meta, as a copy."""
+    chat_meta = get_chat_meta(chat_id)
+    with _LOCK:
+        return {fname: meta["note"] for fname, meta in chat_meta.items()}
+
+
+def forget(chat_id: str):
+    """Drop a chat's cached meta, e.g. when the chat itself is unloaded."""
+    with _LOCK:
+        _CHAT_CACHE.pop(chat_id, None)
+        _FLAG_CACHE.pop(chat_id, None)
+
+
+def _flag_sets(chat_meta):
+    flags = {k: set() for k in STATUS_FLAGS}
+    for filename, meta in chat_meta.items():
+        for k in STATUS_FLAGS:
+            if meta[k]:
+                flags[k].add(filename)
+    return flags
+
+
+def get_chat_flags(chat_id: str):
+    """
+    Return {status flag: frozenset of filenames with it set} for a chat,
+    kept current by save_image_meta, for filtering with set algebra.
+    """
+    chat_meta = get_chat_meta(chat_id)
+    with _LOCK:
+        flags = _FLAG_CACHE.get(chat_id)
+        if flags is None:
+            flags = _flag_sets(chat_meta)
+        return {k: frozenset(v) for k, v in flags.items()}
+
+
+def search_notes(q: str):
+    """Return [(chat_id, filename, note)] for notes containing q, across chats."""
+    q = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    rows = connect().execute(
+        "SELECT chat_id, fname, note FROM image_meta "
+        "WHERE note LIKE ? ESCAPE '\\' AND chat_id IS NOT NULL",
+        (f"%{q}%",),
+    ).fetchall()
+    return [(row["chat_id"], row["fname"], row["note"]) for row in rows]
+
+
+def get_image_meta(chat_id: str, filename: str):
+    meta = get_chat_meta(chat_id).get(filename)
+    return dict(meta) if meta else empty_meta()
+
+
 def save_image_meta(
     chat_id: str,
     filename: str,
@@ -60,17 +179,48 @@ def save_image_meta(
     note: str,
 ):
     key = meta_key(chat_id, filename)
-    DB.execute(
-        """
-        INSERT INTO image_meta (filename, record_found, recorded, not_found, payment_record, note)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(filename) DO UPDATE SET
-            record_found = excluded.record_found,
-            recorded = excluded.recorded,
-            not_found = excluded.not_found,
-            payment_record = excluded.payment_record,
-            note = excluded.note
-        """,
-        (key, record_found, recorded, not_found, payment_record, note),
-    )
-    DB.commit()
+    conn = connect()
+    with _WRITE_LOCK:
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO image_meta (filename, record_found, recorded, not_found, payment_record, note, chat_id, fname)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(filename) DO UPDATE SET
+                    record_found = excluded.record_found,
+                    recorded = excluded.recorded,
+                    not_found = excluded.not_found,
+                    payment_record = excluded.payment_record,
+                    note = excluded.note,
+                    chat_id = excluded.chat_id,
+                    fname = excluded.fname
+                """,
+                (
+                    key,
+                    record_found,
+                    recorded,
+                    not_found,
+                    payment_record,
+                    note,
+                    chat_id,
+                    filename,
+                ),
+            )
+        with _LOCK:
+            _VERSIONS[chat_id] = _VERSIONS.get(chat_id, 0) + 1
+            # keep the cached chat map current rather than dropping it
+            chat_meta = _CHAT_CACHE.get(chat_id)
+            if chat_meta is not None:
+                meta = {
+                    "record_found": int(record_found),
+                    "recorded": int(recorded),
+                    "not_found": int(not_found),
+                    "payment_record": int(payment_record),
+                    "note": note or "",
+                }
+                chat_meta[filename] = meta
+                for k, files in _FLAG_CACHE[chat_id].items():
+                    if meta[k]:
+                        files.add(filename)
+                    else:
+                        files.discard(filename)
@@ -0,0 +1,159 @@
+"""
+Request instrumentation: named phase timers, Prometheus-style histograms
+for /metrics, the per-request totals behind the Server-Timing header and
+opt-in cProfile dumps. With METRICS_ENABLED off, phase() hands out a shared
+no-op context.
+"""
+
+from contextlib import contextmanager, nullcontext
+import bisect
+import itertools
+import os
+import threading
+import time
+
+import config
+
+# Histogram upper bounds in seconds (the +Inf bucket is implicit)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_NULL = nullcontext()
+_local = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one label, rendered as Prometheus text."""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.series = {}  # label value -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value: str, seconds: float):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            counts = self.series.get(value)
+            if counts is None:
+                counts = self.series[value] = [0] * (len(BUCKETS) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {k: list(v) for k, v in self.series.items()}
+        for value, counts in sorted(series.items()):
+            label = f'{self.label}="{_escape(value)}"'
+            total = 0
+            for le, n in zip(BUCKETS + ("+Inf",), counts):
+                total += n
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {counts[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "wa_request_duration_seconds", "Time to build a response, by endpoint.", "endpoint"
+)
+PHASE_SECONDS = Histogram(
+    "wa_phase_duration_seconds",
+    "Time spent in a named phase, summed per request.",
+    "phase",
+)
+
+
+def start_request():
+    """Collect phase totals for the current thread's request."""
+    _local.phases = {}
+
+
+def finish_request(endpoint: str, seconds: float):
+    """
+    Record the request and its phase totals in the histograms. Returns
+    {phase: seconds} in the order the phases first ran.
+    """
+    phases = getattr(_local, "phases", None) or {}
+    _local.phases = None
+    REQUEST_SECONDS.observe(endpoint, seconds)
+    for name, total in phases.items():
+        PHASE_SECONDS.observe(name, total)
+    return phases
+
+
+def record(name: str, seconds: float):
+    phases = getattr(_local, "phases", None)
+    if phases is None:
+        # outside a request (loads in the indexer, background threads)
+        PHASE_SECONDS.observe(name, seconds)
+    else:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def _timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def phase(name: str):
+    """Context manager timing a block as phase name (no-op when disabled)."""
+    if not config.METRICS_ENABLED:
+        return _NULL
+    return _timer(name)
+
+
+def server_timing(phases, total: float) -> str:
+    """Server-Timing header value, durations in milliseconds."""
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def render(extra=()):
+    """
+    Prometheus text exposition of the histograms, plus single-value
+    metrics given as (name, "gauge" or "counter", help, value).
+    """
+    lines = REQUEST_SECONDS.render() + PHASE_SECONDS.render()
+    for name, kind, help, value in extra:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+_PROFILE_LOCK = threading.Lock()  # one profiled request at a time
+_PROFILE_SEQ = itertools.count()
+
+
+def start_profile():
+    """A running cProfile.Profile for this request, or None if one is running."""
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        return None
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, label: str, seconds: float):
+    """Stop profiler; dump it to PROFILE_DIR if the request was slow enough."""
+    profiler.disable()
+    _PROFILE_LOCK.release()
+    if seconds < config.PROFILE_MIN_SECONDS:
+        return None
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    name = f"{stamp}-{next(_PROFILE_SEQ):04d}-{label}-{int(seconds * 1000)}ms.prof"
+    path = os.path.join(config.PROFILE_DIR, name)
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,691 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+DB = sqlite3.connect(config.OCR_DB_PATH, check_same_thread=False, timeout=30)
+DB.row_factory = sqlite3.Row
+DB.execute("PRAGMA journal_mode=WAL")
+
+# OCR results are written from background threads
+_LOCK = threading.Lock()
+
+# OCR output is content-addressed: identical image bytes anywhere in any chat
+# share one ocr_results row. ocr_files maps each chat file to its content hash.
+DB.executescript(
+    """
+-- boxes are normalized to 0..1 of width x height; results adopted from the
+-- legacy JSON cache have NULL width/height and pixel boxes until backfilled.
+-- conf is the mean word confidence (0-100) of the kept Tesseract pass, made
+-- with the configured passes (see ocr_utils.passes_key)
+CREATE TABLE IF NOT EXISTS ocr_results (
+    content_hash TEXT PRIMARY KEY,
+    phash TEXT,
+    text TEXT DEFAULT '',
+    boxes TEXT DEFAULT '[]',
+    width INTEGER,
+    height INTEGER,
+    conf REAL,
+    passes TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS ocr_results_phash ON ocr_results(phash);
+
+CREATE TABLE IF NOT EXISTS ocr_files (
+    chat_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    PRIMARY KEY (chat_id, filename)
+);
+
+-- results imported from the old JSON cache, which has no content hash;
+-- adopted into ocr_results the first time the file is seen unchanged
+CREATE TABLE IF NOT EXISTS ocr_legacy (
+    chat_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mtime REAL,
+    text TEXT DEFAULT '',
+    boxes TEXT DEFAULT '[]',
+    PRIMARY KEY (chat_id, filename)
+);
+
+-- images waiting for OCR, so a killed run resumes where it stopped; a row is
+-- deleted once its file is linked. status is pending, running (claimed by
+-- the process whose token is in owner, see _process_token) or failed (after
+-- OCR_MAX_ATTEMPTS, with the last error)
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    chat_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    queued_at REAL,
+    PRIMARY KEY (chat_id, filename)
+);
+CREATE INDEX IF NOT EXISTS ocr_jobs_next
+    ON ocr_jobs(chat_id, status, priority DESC, queued_at);
+"""
+)
+
+
+def normalize_boxes(boxes, width: int, height: int):
+    """
+    Convert pixel boxes (left/top/width/height) to fractions of the image,
+    keeping each box's "conf" when it has one.
+    """
+    out = []
+    for b in boxes:
+        box = {
+            "text": b.get("text", ""),
+            "x": b["left"] / width,
+            "y": b["top"] / height,
+            "w": b["width"] / width,
+            "h": b["height"] / height,
+        }
+        if "conf" in b:
+            box["conf"] = b["conf"]
+        out.append(box)
+    return out
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def perceptual_hash(img) -> str:
+    """
+    256-bit difference hash of a PIL image. Stable across recompression and
+    resizing, so it matches re-encoded copies of the same picture.
+    """
+    small = img.convert("L").resize((17, 16))
+    px = list(small.getdata())
+    bits = 0
+    for row in range(16):
+        base = row * 17
+        for col in range(16):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return f"{bits:064x}"
+
+
+def _dump_boxes(boxes) -> str:
+    return json.dumps(boxes, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_chat_files(chat_id: str):
+    """
+    Return {filename: {"content_hash", "mtime", "size", "text", "normalized",
+    "conf", "passes"}} for a chat's files with a stored result. Boxes are left
+    in the database; see get_boxes. normalized is False for rows still
+    holding pixel boxes.
+    """
+    with _LOCK:
+        rows = DB.execute(
+            "SELECT f.filename, f.content_hash, f.mtime, f.size, r.text, r.width, "
+            "r.conf, r.passes "
+            "FROM ocr_files f JOIN ocr_results r ON r.content_hash = f.content_hash "
+            "WHERE f.chat_id = ?",
+            (chat_id,),
+        ).fetchall()
+    return {
+        row["filename"]: {
+            "content_hash": row["content_hash"],
+            "mtime": row["mtime"],
+            "size": row["size"],
+            "text": row["text"] or "",
+            "normalized": row["width"] is not None,
+            "conf": row["conf"],
+            "passes": row["passes"],
+        }
+        for row in rows
+    }
+
+
+def get_chat_hashes(chat_id: str):
+    """
+    Return {filename: (content_hash, mtime, size, updated_at)} for a chat's
+    linked files, without their text; cheap enough to poll. updated_at is
+    when the result was last stored, so a file re-OCR'd under the same
+    content hash shows up too.
+    """
+    with _LOCK:
+        rows = DB.execute(
+            "SELECT f.filename, f.content_hash, f.mtime, f.size, r.updated_at "
+            "FROM ocr_files f LEFT JOIN ocr_results r USING (content_hash) "
+            "WHERE f.chat_id = ?",
+            (chat_id,),
+        ).fetchall()
+    return {
+        row["filename"]: (
+            row["content_hash"],
+            row["mtime"],
+            row["size"],
+            row["updated_at"] or 0,
+        )
+        for row in rows
+    }
+
+
+def last_update(chat_id: str) -> float:
+    """Newest updated_at among the results linked to a chat's files, or 0."""
+    with _LOCK:
+        row = DB.execute(
+            "SELECT MAX(r.updated_at) FROM ocr_files f "
+            "JOIN ocr_results r USING (content_hash) WHERE f.chat_id = ?",
+            (chat_id,),
+        ).fetchone()
+    return row[0] or 0
+
+
+def like_pattern(q: str) -> str:
+    """LIKE pattern matching q anywhere, for use with ESCAPE '\\'."""
+    q = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{q}%"
+
+
+def search_text(q: str):
+    """
+    Return [(chat_id, filename, text, conf)] for linked files whose OCR text
+    contains q (case-insensitive for ASCII), across all chats. conf is the
+    confidence of the match (see match_confidence), None when unknown.
+    """
+    with _LOCK:
+        rows = DB.execute(
+            "SELECT f.chat_id, f.filename, r.text, r.boxes, r.conf "
+            "FROM ocr_files f JOIN ocr_results r ON r.content_hash = f.content_hash "
+            "WHERE r.text LIKE ? ESCAPE '\\'",
+            (like_pattern(q),),
+        ).fetchall()
+    out = []
+    for row in rows:
+        conf = match_confidence(json.loads(row["boxes"] or "[]"), q)
+        if conf is None:
+            conf = row["conf"]
+        out.append((row["chat_id"], row["filename"], row["text"], conf))
+    return out
+
+
+def match_confidence(boxes, q: str):
+    """
+    Mean Tesseract confidence (0-100) of the boxes holding a word of the
+    lower-cased query q, or None if no such box has a confidence.
+    """
+    words = q.split()
+    confs = [
+        b["conf"]
+        for b in boxes
+        if "conf" in b and any(w in b["text"] for w in words)
+    ]
+    return sum(confs) / len(confs) if confs else None
+
+
+def get_text(content_hash: str):
+    """OCR text stored for content_hash, or None if it was never OCR'd."""
+    with _LOCK:
+        row = DB.execute(
+            "SELECT text FROM ocr_results WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+    return None if row is None else (row["text"] or "")
+
+
+def get_quality(content_hash: str):
+    """(conf, passes) stored for content_hash, or None if it was never OCR'd."""
+    with _LOCK:
+        row = DB.execute(
+            "SELECT conf, passes FROM ocr_results WHERE content_hash = ?",
+            (content_hash,),
+        ).fetchone()
+    return None if row is None else (row["conf"], row["passes"])
+
+
+def is_normalized(content_hash: str) -> bool:
+    with _LOCK:
+        row = DB.execute(
+            "SELECT width FROM ocr_results WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+    return row is not None and row["width"] is not None
+
+
+def normalize_result(content_hash: str, width: int, height: int):
+    """Rewrite a pre-normalization row's pixel boxes using the image size."""
+    with _LOCK:
+        row = DB.execute(
+            "SELECT boxes, width FROM ocr_results WHERE content_hash = ?",
+            (content_hash,),
+        ).fetchone()
+        if row is None or row["width"] is not None:
+            return
+        try:
+            boxes = json.loads(row["boxes"] or "[]")
+        except ValueError:
+            boxes = []
+        DB.execute(
+            "UPDATE ocr_results SET boxes = ?, width = ?, height = ? "
+            "WHERE content_hash = ?",
+            (
+                _dump_boxes(normalize_boxes(boxes, width, height)),
+                width,
+                height,
+                content_hash,
+            ),
+        )
+        DB.commit()
+
+
+def find_by_phash(phash: str):
+    """(content_hash, text) of a stored result with the same perceptual hash."""
+    with _LOCK:
+        row = DB.execute(
+            "SELECT content_hash, text FROM ocr_results WHERE phash = ? LIMIT 1",
+            (phash,),
+        ).fetchone()
+    if row is None:
+        return None
+    return row["content_hash"], row["text"] or ""
+
+
+def get_boxes(content_hash: str):
+    if not content_hash:
+        return []
+    with _LOCK:
+        row = DB.execute(
+            "SELECT boxes FROM ocr_results WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+    if not row or not row["boxes"]:
+        return []
+    try:
+        return json.loads(row["boxes"])
+    except ValueError:
+        return []
+
+
+def save_result(
+    content_hash: str,
+    text: str,
+    boxes,
+    width=None,
+    height=None,
+    phash=None,
+    conf=None,
+    passes=None,
+):
+    """
+    Store OCR output; boxes must already be normalized when width is set.
+    conf is the mean word confidence, None for text-free images, and passes
+    describes the Tesseract passes configured (see ocr_utils.passes_key).
+    """
+    with _LOCK:
+        DB.execute(
+            """
+            INSERT INTO ocr_results
+                (content_hash, phash, text, boxes, width, height, conf, passes,
+                 updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET
+                phash = COALESCE(excluded.phash, phash),
+                text = excluded.text,
+                boxes = excluded.boxes,
+                width = excluded.width,
+                height = excluded.height,
+                conf = excluded.conf,
+                passes = excluded.passes,
+                updated_at = excluded.updated_at
+            """,
+            (
+                content_hash,
+                phash,
+                text,
+                _dump_boxes(boxes),
+                width,
+                height,
+                conf,
+                passes,
+                time.time(),
+            ),
+        )
+        DB.commit()
+
+
+def link_file(chat_id: str, filename: str, content_hash: str, mtime, size):
+    """Point (chat_id, filename) at the result for content_hash."""
+    with _LOCK:
+        DB.execute(
+            """
+            INSERT INTO ocr_files (chat_id, filename, content_hash, mtime, size)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, filename) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                mtime = excluded.mtime,
+                size = excluded.size
+            """,
+            (chat_id, filename, content_hash, mtime, size),
+        )
+        DB.commit()
+
+
+def adopt_legacy(chat_id: str, filename: str, mtime, content_hash: str):
+    """
+    Move an old JSON-cache result for an unchanged file under its content
+    hash. Returns the text, or None when there is no usable legacy entry.
+    """
+    with _LOCK:
+        row = DB.execute(
+            "SELECT mtime, text, boxes FROM ocr_legacy WHERE chat_id = ? AND filename = ?",
+            (chat_id, filename),
+        ).fetchone()
+        if row is None:
+            return None
+        DB.execute(
+            "DELETE FROM ocr_legacy WHERE chat_id = ? AND filename = ?",
+            (chat_id, filename),
+        )
+        if row["mtime"] != mtime:
+            DB.commit()
+            return None
+        DB.execute(
+            "INSERT OR IGNORE INTO ocr_results (content_hash, text, boxes) "
+            "VALUES (?, ?, ?)",
+            (content_hash, row["text"] or "", row["boxes"] or "[]"),
+        )
+        DB.commit()
+    return row["text"] or ""
+
+
+def enqueue_jobs(chat_id: str, files):
+    """
+    Queue [(filename, mtime, size)] for OCR. Files already queued keep their
+    place; a changed file is queued afresh. Returns the filenames that are
+    marked failed for these same bytes and are not retried.
+    """
+    now = time.time()
+    failed = []
+    with _LOCK:
+        existing = {
+            row["filename"]: row
+            for row in DB.execute(
+                "SELECT filename, mtime, size, status FROM ocr_jobs WHERE chat_id = ?",
+                (chat_id,),
+            )
+        }
+        for filename, mtime, size in files:
+            row = existing.get(filename)
+            if row is not None and row["mtime"] == mtime and row["size"] == size:
+                if row["status"] == "failed":
+                    failed.append(filename)
+                continue
+            DB.execute(
+                """
+                INSERT INTO ocr_jobs (chat_id, filename, mtime, size, queued_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, filename) DO UPDATE SET
+                    mtime = excluded.mtime,
+                    size = excluded.size,
+                    status = 'pending',
+                    attempts = 0,
+                    error = NULL,
+                    owner = NULL,
+                    queued_at = excluded.queued_at
+                """,
+                (chat_id, filename, mtime, size, now),
+            )
+        DB.commit()
+    return failed
+
+
+def claim_job(chat_id: str):
+    """
+    Mark the chat's most urgent pending job running in this process and
+    return it as (filename, mtime, size), or None when none is pending.
+    """
+    with _LOCK:
+        while True:
+            row = DB.execute(
+                "SELECT filename, mtime, size FROM ocr_jobs "
+                "WHERE chat_id = ? AND status = 'pending' "
+                "ORDER BY priority DESC, queued_at LIMIT 1",
+                (chat_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            # another process may claim it between the SELECT and here
+            cur = DB.execute(
+                "UPDATE ocr_jobs SET status = 'running', owner = ?, "
+                "attempts = attempts + 1 "
+                "WHERE chat_id = ? AND filename = ? AND status = 'pending'",
+                (_OWNER, chat_id, row["filename"]),
+            )
+            DB.commit()
+            if cur.rowcount:
+                return row["filename"], row["mtime"], row["size"]
+
+
+def finish_jobs(chat_id: str, filenames):
+    with _LOCK:
+        DB.executemany(
+            "DELETE FROM ocr_jobs WHERE chat_id = ? AND filename = ?",
+            ((chat_id, f) for f in filenames),
+        )
+        DB.commit()
+
+
+def fail_job(chat_id: str, filename: str, error: str) -> bool:
+    """
+    Record a failed attempt. The job goes to the back of the queue until it
+    has used OCR_MAX_ATTEMPTS; returns True when it is now marked failed.
+    """
+    with _LOCK:
+        DB.execute(
+            "UPDATE ocr_jobs SET error = ?, owner = NULL, queued_at = ?, priority = 0, "
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END "
+            "WHERE chat_id = ? AND filename = ?",
+            (error, time.time(), config.OCR_MAX_ATTEMPTS, chat_id, filename),
+        )
+        DB.commit()
+        row = DB.execute(
+            "SELECT status FROM ocr_jobs WHERE chat_id = ? AND filename = ?",
+            (chat_id, filename),
+        ).fetchone()
+    return row is None or row["status"] == "failed"
+
+
+def boost_jobs(chat_id: str, filenames):
+    """Move pending jobs for filenames ahead of every job boosted before."""
+    priority = int(time.time() * 1000)
+    with _LOCK:
+        DB.executemany(
+            "UPDATE ocr_jobs SET priority = ? "
+            "WHERE chat_id = ? AND filename = ? AND status = 'pending'",
+            ((priority, chat_id, f) for f in filenames),
+        )
+        DB.commit()
+
+
+def has_pending_jobs(chat_id: str) -> bool:
+    with _LOCK:
+        row = DB.execute(
+            "SELECT 1 FROM ocr_jobs WHERE chat_id = ? AND status = 'pending' LIMIT 1",
+            (chat_id,),
+        ).fetchone()
+    return row is not None
+
+
+def failed_jobs(chat_id: str):
+    """[{"filename", "attempts", "error"}] of the chat's images that failed OCR."""
+    with _LOCK:
+        rows = DB.execute(
+            "SELECT filename, attempts, error FROM ocr_jobs "
+            "WHERE chat_id = ? AND status = 'failed' ORDER BY filename",
+            (chat_id,),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def queued_chats():
+    """Chat ids with OCR jobs still pending or running."""
+    with _LOCK:
+        rows = DB.execute(
+            "SELECT DISTINCT chat_id FROM ocr_jobs "
+            "WHERE status IN ('pending', 'running')"
+        ).fetchall()
+    return [row["chat_id"] for row in rows]
+
+
+def _process_token(pid: int):
+    """
+    "<pid>-<start time>" for a running process, or None if there is none.
+    The start time (from /proc) tells a reused pid apart from the process
+    that claimed a job, e.g. a restarted container's app, which is pid 1
+    again. Without /proc it is the bare pid, if a process has it.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except FileNotFoundError:
+        if os.path.isdir("/proc/self"):
+            return None
+    except OSError:
+        pass
+    else:
+        # the fields after the parenthesised command name; starttime is 22nd
+        return f"{pid}-{stat.rsplit(')', 1)[1].split()[19]}"
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except OSError:
+        pass  # exists but not ours
+    return str(pid)
+
+
+_OWNER = _process_token(os.getpid())
+
+
+def _owner_alive(owner) -> bool:
+    if not owner or owner == _OWNER:
+        return False  # left by an earlier run of this process's pid
+    pid = owner.split("-", 1)[0]
+    return pid.isdigit() and _process_token(int(pid)) == owner
+
+
+def _requeue_orphaned_jobs():
+    """
+    Put jobs claimed by processes that have since died back in the queue.
+    Run at import, before this process claims any; a running indexer or app
+    keeps its jobs.
+    """
+    with _LOCK:
+        owners = [
+            row["owner"]
+            for row in DB.execute(
+                "SELECT DISTINCT owner FROM ocr_jobs WHERE status = 'running'"
+            )
+        ]
+        dead = [owner for owner in owners if not _owner_alive(owner)]
+        DB.executemany(
+            "UPDATE ocr_jobs SET status = 'pending', owner = NULL "
+            "WHERE status = 'running' AND owner IS ?",
+            ((owner,) for owner in dead),
+        )
+        DB.commit()
+
+
+class OcrTextMap:
+    """
+    Per-chat filename -> OCR text view resolved through content hashes, so
+    a picture forwarded many times is held once.
+    """
+
+    def __init__(self):
+        self.hashes = {}  # filename -> content hash
+        self.texts = {}  # content hash -> lower-case text
+
+    def set(self, filename, content_hash, text):
+        self.texts[content_hash] = text.lower()
+        self.hashes[filename] = content_hash
+
+    def get(self, filename, default=None):
+        content_hash = self.hashes.get(filename)
+        if content_hash is None:
+            return default
+        return self.texts.get(content_hash, default)
+
+    def __getitem__(self, filename):
+        return self.texts[self.hashes[filename]]
+
+    def __contains__(self, filename):
+        return filename in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+class BoxMap:
+    """Read-only, dict-like view of a chat's OCR boxes, loaded per file."""
+
+    def __init__(self, text_map: OcrTextMap):
+        self.text_map = text_map
+
+    def get(self, filename, default=None):
+        boxes = get_boxes(self.text_map.hashes.get(filename))
+        if not boxes and default is not None:
+            return default
+        return boxes
+
+    def __getitem__(self, filename):
+        return get_boxes(self.text_map.hashes.get(filename))
+
+
+def migrate_json_cache():
+    """One-shot import of the old image_ocr_cache_multi.json file."""
+    path = config.OCR_CACHE_FILE
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"OCR cache migration skipped, unreadable {path}: {e}")
+        return
+    if not isinstance(data, dict):
+        data = {}
+
+    count = 0
+    with _LOCK:
+        for chat_id, chat_cache in data.items():
+            if not isinstance(chat_cache, dict):
+                continue
+            for filename, entry in chat_cache.items():
+                if not isinstance(entry, dict) or "text" not in entry:
+                    continue
+                DB.execute(
+                    "INSERT OR IGNORE INTO ocr_legacy "
+                    "(chat_id, filename, mtime, text, boxes) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        chat_id,
+                        filename,
+                        entry.get("mtime"),
+                        entry.get("text") or "",
+                        _dump_boxes(entry.get("boxes") or []),
+                    ),
+                )
+                count += 1
+        DB.commit()
+    os.replace(path, path + ".migrated")
+    print(f"Migrated {count} OCR cache entries from {path}.")
+
+
+migrate_json_cache()
+_requeue_orphaned_jobs()
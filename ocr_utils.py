@@ -1,12 +1,17 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import os
-import json
+import threading
+import time
 
 import config
+import metrics
+import ocr_store
 import parsing
 
 # Try to import OCR deps
 try:
-    from PIL import Image
+    from PIL import Image, ImageFilter, ImageStat
     import pytesseract
     from pytesseract import Output  # noqa: F401
 
@@ -16,117 +21,568 @@ except ImportError:
     Image = None
     print("OCR not available (install pillow + pytesseract).")
 
-
-def load_ocr_cache_all():
-    if not os.path.exists(config.OCR_CACHE_FILE):
-        return {}
+if OCR_AVAILABLE:
     try:
-        with open(config.OCR_CACHE_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            return data
-        return {}
-    except Exception:
-        return {}
+        pytesseract.get_tesseract_version()
+    except pytesseract.TesseractNotFoundError:
+        OCR_AVAILABLE = False
+        print("OCR not available (tesseract binary not found).")
 
 
-def save_ocr_cache_all(cache_all):
-    try:
-        with open(config.OCR_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache_all, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+def prepare_image(img):
+    """
+    Grayscale copy of the image's first frame (GIFs, multi-page TIFFs) with
+    its longest side scaled down to OCR_MAX_SIDE, which is all Tesseract
+    needs for chat-sized text. Transparent pixels are flattened onto white:
+    dropping alpha would leave them whatever colour they hold, often black,
+    hiding dark text on a transparent sticker or screenshot.
+    """
+    img.seek(0)
+    if "A" in img.getbands() or "transparency" in img.info:
+        rgba = img.convert("RGBA")
+        img = Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba)
+    gray = img.convert("L")
+    longest = max(gray.size)
+    if longest > config.OCR_MAX_SIDE:
+        scale = config.OCR_MAX_SIDE / longest
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.LANCZOS)
+    return gray
+
+
+def text_likelihood(gray):
+    """
+    (edge density, contrast) of a grayscale image, measured on a 512px copy:
+    the share of pixels on an edge stronger than OCR_EDGE_LEVEL and the
+    standard deviation of the pixel values. Text is many sharp edges;
+    smooth photos and flat pictures have next to none.
+    """
+    small = gray.copy()
+    small.thumbnail((512, 512))
+    contrast = ImageStat.Stat(small).stddev[0]
+    edges = small.filter(ImageFilter.FIND_EDGES)
+    # the filter marks the 1px frame as edges
+    edges = edges.crop((1, 1, max(2, edges.width - 1), max(2, edges.height - 1)))
+    strong = sum(edges.histogram()[config.OCR_EDGE_LEVEL :])
+    return strong / (edges.width * edges.height), contrast
+
+
+def looks_textless(gray) -> bool:
+    """True for images too flat or too smooth to hold readable text."""
+    if not config.OCR_FAST_REJECT:
+        return False
+    density, contrast = text_likelihood(gray)
+    return contrast < config.OCR_MIN_CONTRAST or density < config.OCR_MIN_EDGE_DENSITY
+
+
+_PASSES = None
+
+
+def ocr_passes():
+    """
+    [(lang, psm)] Tesseract passes in the order they are tried: each of
+    OCR_PSMS for the first OCR_LANGS set, then for the next set, and so on.
+    Language sets with a language Tesseract doesn't have are left out.
+    """
+    global _PASSES
+    if _PASSES is None:
+        try:
+            installed = set(pytesseract.get_languages(config=""))
+        except Exception:
+            installed = None  # let Tesseract report it per image
+        langs = []
+        for lang in config.OCR_LANGS:
+            missing = [
+                part
+                for part in lang.split("+")
+                if installed is not None and part not in installed
+            ]
+            if missing:
+                missing = ", ".join(missing)
+                print(f"OCR languages {lang!r} skipped ({missing} not installed).")
+            else:
+                langs.append(lang)
+        langs = langs or config.OCR_LANGS[:1]
+        _PASSES = [(lang, psm) for lang in langs for psm in config.OCR_PSMS]
+    return _PASSES
+
+
+def passes_key(passes) -> str:
+    """Passes as stored with a result, e.g. "eng/3 eng/11 hin+guj+eng/3"."""
+    return " ".join(f"{lang}/{psm}" for lang, psm in passes)
+
+
+def is_outdated(conf, passes) -> bool:
+    """
+    True for a stored result worth OCR-ing again: low confidence, and made
+    with other passes than are configured now (e.g. before a language was
+    added). Text-free images and older results without a confidence are
+    kept.
+    """
+    if conf is None or conf >= config.OCR_MIN_CONFIDENCE:
+        return False
+    return passes != passes_key(ocr_passes())
+
+
+def _read_words(data):
+    """(words, pixel boxes, mean word confidence) from image_to_data output."""
+    words = []
+    boxes = []
+    for i, word in enumerate(data["text"]):
+        word = (word or "").strip()
+        if not word:
+            continue
+        conf = max(0.0, float(data["conf"][i]))
+        words.append(word)
+        boxes.append(
+            {
+                "text": word.lower(),
+                "left": int(data["left"][i]),
+                "top": int(data["top"][i]),
+                "width": int(data["width"][i]),
+                "height": int(data["height"][i]),
+                "conf": round(conf),
+            }
+        )
+    mean = sum(b["conf"] for b in boxes) / len(boxes) if boxes else 0.0
+    return words, boxes, mean
+
+
+def ocr_image(image_path: str, passes=None):
+    """
+    Run Tesseract on one image and return (full_text, boxes, size, phash,
+    stats). Boxes are normalized to fractions of size so search never
+    reopens the image, and carry their word confidence (0-100). Images
+    that look text-free are not OCR'd. Further passes (see ocr_passes) run
+    only while the mean word confidence stays under OCR_MIN_CONFIDENCE and
+    the last pass found some words; the most confident one is returned.
+    stats is {"rejected", "prep_s", "ocr_s", "passes", "conf"}, conf being
+    None when no words were found. Executed inside OCR worker processes, so
+    it must stay picklable.
+    """
+    started = time.perf_counter()
+    with Image.open(image_path) as img:
+        size = img.size
+        phash = ocr_store.perceptual_hash(img)
+        gray = prepare_image(img)
+    rejected = looks_textless(gray)
+    prepared = time.perf_counter()
+    stats = {
+        "rejected": rejected,
+        "prep_s": prepared - started,
+        "ocr_s": 0.0,
+        "passes": 0,
+        "conf": None,
+    }
+    if rejected:
+        return "", [], size, phash, stats
+
+    best = None
+    found = True
+    for lang, psm in passes or ocr_passes():
+        if best is not None and (best[2] >= config.OCR_MIN_CONFIDENCE or not found):
+            break
+        data = pytesseract.image_to_data(
+            gray,
+            lang=lang,
+            config=f"--psm {psm}",
+            output_type=Output.DICT,
+            timeout=config.OCR_TIMEOUT,
+        )
+        result = _read_words(data)
+        # no words at all: more passes rarely find any either
+        found = bool(result[0])
+        if best is None or result[2] > best[2]:
+            best = result
+        stats["passes"] += 1
+    stats["ocr_s"] = time.perf_counter() - prepared
+
+    words, boxes, conf = best
+    # no words: nothing to be confident about, treated like a text-free image
+    stats["conf"] = conf if words else None
+    # boxes are in the prepared image's pixels; fractions are the same
+    boxes = ocr_store.normalize_boxes(boxes, *gray.size)
+    return " ".join(words), boxes, size, phash, stats
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+OCR_PROGRESS = {}  # chat_id -> progress dict
+_RUNNERS = {}  # chat_id -> {"chat", "progress"} of its background job runner
+_RUNNERS_LOCK = threading.Lock()
+
+
+def get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=config.OCR_WORKERS)
+        return _POOL
+
+
+def reset_pool(pool):
+    """Drop a broken pool so the next get_pool() starts a fresh one."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown()
+            _POOL = None
+
+
+def get_progress(chat_id: str):
+    progress = OCR_PROGRESS.get(chat_id)
+    if progress is None:
+        return {"state": "idle", "total": 0, "done": 0, "cached": 0, "failed": 0}
+    return dict(progress)
 
 
-def build_image_ocr_index_for_chat(chat_state):
+def build_image_ocr_index_for_chat(
+    chat_state, filenames=None, background=True, resolve=True
+):
     """
-    Given a ChatState, populate:
-      chat_state.image_ocr[filename] = lower-case text
-      chat_state.image_boxes[filename] = list of box dicts
-    And save to shared OCR cache file.
+    Given a ChatState, populate chat_state.image_ocr (filename -> content
+    hash -> lower-case text); chat_state.image_boxes resolves boxes the same
+    way. Files whose stats match the OCR store are applied immediately. The
+    rest are queued in the OCR store and worked through in a background
+    thread (unless background=False): bytes already OCR'd in any chat are
+    reused, everything else goes to the worker pool and lands in the
+    ChatState as it completes. Jobs left by a stopped process are picked up
+    again here. Pass filenames to resolve only those attachments (e.g. ones
+    appended to the chat). With resolve=False only stored results are
+    applied and nothing is hashed or OCR'd, leaving that to the indexer; that
+    works without Tesseract.
     """
-    if not OCR_AVAILABLE:
+    if not OCR_AVAILABLE and resolve:
         return
 
-    image_exts = (".jpg", ".jpeg", ".png", ".gif", ".webp")
-    all_cache = load_ocr_cache_all()
-    chat_cache = all_cache.get(chat_state.chat_id, {})
+    image_exts = parsing.IMAGE_EXTS
+    chat_id = chat_state.chat_id
+    known = ocr_store.get_chat_files(chat_id)
 
-    seen = set()
+    unresolved = []  # (fname_clean, mtime, size)
+    cached_count = 0
+    outdated = 0
 
-    for msg in chat_state.messages:
-        for fname in msg.get("attachments", []):
-            fname_clean = parsing.clean_attachment(fname)
-            if fname_clean in seen:
+    partial = filenames is not None
+    if filenames is None:
+        filenames = chat_state.attachments
+    for fname in filenames:
+        fname_clean = parsing.clean_attachment(fname)
+        if not fname_clean.lower().endswith(image_exts):
+            continue
+
+        image_path = os.path.join(chat_state.media_dir, fname_clean)
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            continue
+
+        cached = known.get(fname_clean)
+        if cached and cached["mtime"] == st.st_mtime and cached["size"] == st.st_size:
+            chat_state.image_ocr.set(fname_clean, cached["content_hash"], cached["text"])
+            if resolve and is_outdated(cached["conf"], cached["passes"]):
+                # shown as is until the current passes have had a go
+                outdated += 1
+            elif cached["normalized"]:
+                cached_count += 1
                 continue
-            seen.add(fname_clean)
 
-            if not fname_clean.lower().endswith(image_exts):
+        unresolved.append((fname_clean, st.st_mtime, st.st_size))
+
+    skipped = 0
+    failed = []
+    if not resolve:
+        skipped = len(unresolved)
+        unresolved = []
+    elif unresolved:
+        failed = ocr_store.enqueue_jobs(chat_id, unresolved)
+    queued = len(unresolved) - len(failed)
+    print(
+        f"[{chat_id}] OCR: {cached_count} cached, {queued} queued "
+        f"({outdated} for the current OCR passes), "
+        f"{len(failed)} failed earlier, {skipped} left for the indexer."
+    )
+
+    with _RUNNERS_LOCK:
+        runner = _RUNNERS.get(chat_id) if background else None
+        if runner is not None and partial:
+            # more images for the running runner; count them in its progress
+            progress = runner["progress"]
+            progress["total"] += cached_count + len(unresolved)
+            progress["done"] += cached_count + len(failed)
+            progress["cached"] += cached_count
+            progress["failed"] += len(failed)
+        else:
+            progress = {
+                "state": "done",
+                "total": cached_count + len(unresolved),
+                "done": cached_count + len(failed),
+                "cached": cached_count,
+                "deduped": 0,
+                "failed": len(failed),
+                "skipped": skipped,
+                "rejected": 0,
+                "tesseract_runs": 0,
+                "extra_passes": 0,
+                "tesseract_s": 0.0,
+                "saved_s": 0.0,
+                "started_at": time.time(),
+                "finished_at": time.time(),
+            }
+            OCR_PROGRESS[chat_id] = progress
+        if queued:
+            progress["state"] = "running"
+            progress["finished_at"] = None
+        if runner is not None:
+            # a reloaded chat takes over the runner's results
+            runner["chat"] = chat_state
+            runner["progress"] = progress
+            return
+        if not queued:
+            return
+        runner = {"chat": chat_state, "progress": progress}
+        if background:
+            _RUNNERS[chat_id] = runner
+
+    if background:
+        t = threading.Thread(
+            target=_run_ocr_jobs,
+            args=(chat_id, runner),
+            name=f"ocr-{chat_id}",
+            daemon=True,
+        )
+        t.start()
+    else:
+        _run_ocr_jobs(chat_id, runner)
+
+
+def boost_jobs(chat_id: str, filenames):
+    """
+    Let queued OCR of filenames (the images on screen) go before the rest.
+    A no-op unless the chat's runner is working in this process.
+    """
+    if chat_id not in _RUNNERS:
+        return
+    names = [
+        parsing.clean_attachment(f)
+        for f in filenames
+        if f.lower().endswith(parsing.IMAGE_EXTS)
+    ]
+    if names:
+        ocr_store.boost_jobs(chat_id, names)
+
+
+def _normalize_stored(content_hash, image_path):
+    """Backfill image size and normalized boxes for an older stored result."""
+    if ocr_store.is_normalized(content_hash):
+        return
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return
+    ocr_store.normalize_result(content_hash, width, height)
+
+
+def _link(chat_state, fname_clean, content_hash, mtime, size, text):
+    ocr_store.link_file(chat_state.chat_id, fname_clean, content_hash, mtime, size)
+    chat_state.image_ocr.set(fname_clean, content_hash, text)
+    chat_state.search_index.update_ocr(fname_clean)
+
+
+def _resolve_existing(chat_state, fname_clean, image_path, content_hash, mtime):
+    """
+    Find a stored result for this file without running Tesseract: same bytes,
+    an old JSON-cache entry, or (if enabled) a perceptually identical image.
+    Outdated results (see is_outdated) are not reused. Returns
+    (content_hash, text) or None.
+    """
+    text = ocr_store.get_text(content_hash)
+    if text is not None and is_outdated(*ocr_store.get_quality(content_hash)):
+        return None
+    if text is None:
+        text = ocr_store.adopt_legacy(
+            chat_state.chat_id, fname_clean, mtime, content_hash
+        )
+    if text is not None:
+        return content_hash, text
+    if config.OCR_PHASH_DEDUP:
+        try:
+            with Image.open(image_path) as img:
+                match = ocr_store.find_by_phash(ocr_store.perceptual_hash(img))
+        except Exception:
+            return None
+        if match is not None and not is_outdated(*ocr_store.get_quality(match[0])):
+            return match
+    return None
+
+
+def _run_ocr_jobs(chat_id, runner):
+    """
+    Work through the chat's queued jobs, most urgent first: hash each image
+    and reuse any stored result for its bytes, feed the rest to the worker
+    pool with at most OCR_QUEUE_SIZE in flight, and store, apply and dequeue
+    each result as soon as it completes. Identical files within the chat
+    wait on a single OCR job. Failures are retried up to OCR_MAX_ATTEMPTS;
+    if a worker dies and breaks the pool, the images in flight count as
+    failed and a fresh pool takes over. runner is {"chat": ChatState,
+    "progress": dict}; both may be swapped while this runs.
+    """
+    pool = get_pool()
+    passes = ocr_passes()
+    in_flight = {}  # future -> content hash
+    waiting = {}  # content hash -> [(fname_clean, mtime, size), ...]
+
+    def fail(fname_clean, error):
+        print(f"[{chat_id}] OCR failed for {fname_clean}: {error}")
+        if ocr_store.fail_job(chat_id, fname_clean, str(error) or type(error).__name__):
+            runner["progress"]["failed"] += 1
+            runner["progress"]["done"] += 1
+
+    def fail_waiting(error):
+        # every claimed job is in waiting until it is finished or failed
+        for files in waiting.values():
+            for fname_clean, _, _ in files:
+                fail(fname_clean, error)
+        waiting.clear()
+        in_flight.clear()
+
+    def submit_next():
+        while True:
+            job = ocr_store.claim_job(chat_id)
+            if job is None:
+                return False
+            fname_clean, mtime, size = job
+            chat = runner["chat"]
+            image_path = os.path.join(chat.media_dir, fname_clean)
+            try:
+                content_hash = ocr_store.file_hash(image_path)
+            except OSError as e:
+                fail(fname_clean, e)
                 continue
 
-            image_path = os.path.join(chat_state.media_dir, fname_clean)
-            if not os.path.exists(image_path):
+            if content_hash in waiting:
+                waiting[content_hash].append(job)
                 continue
 
-            try:
-                mtime = os.path.getmtime(image_path)
-            except OSError:
-                mtime = None
-
-            cached = chat_cache.get(fname_clean)
-            if (
-                cached
-                and isinstance(cached, dict)
-                and cached.get("mtime") == mtime
-                and "text" in cached
-            ):
-                text = cached.get("text") or ""
-                boxes = cached.get("boxes") or []
-                chat_state.image_ocr[fname_clean] = text.lower()
-                chat_state.image_boxes[fname_clean] = boxes
-                print(f"[{chat_state.chat_id}] OCR cache hit for {fname_clean}")
+            found = _resolve_existing(
+                chat, fname_clean, image_path, content_hash, mtime
+            )
+            if found is not None:
+                _normalize_stored(found[0], image_path)
+                _link(chat, fname_clean, found[0], mtime, size, found[1])
+                ocr_store.finish_jobs(chat_id, [fname_clean])
+                runner["progress"]["deduped"] += 1
+                runner["progress"]["done"] += 1
                 continue
 
-            # fresh OCR
+            waiting[content_hash] = [job]
+            in_flight[pool.submit(ocr_image, image_path, passes)] = content_hash
+            return True
+
+    state = "error"
+    try:
+        while True:
             try:
-                img = Image.open(image_path)
-                data = pytesseract.image_to_data(
-                    img, lang="eng", output_type=Output.DICT
-                )
-
-                full_text_parts = []
-                boxes = []
-                n = len(data["text"])
-                for i in range(n):
-                    word = data["text"][i]
-                    if not word or word.strip() == "":
+                while len(in_flight) < config.OCR_QUEUE_SIZE and submit_next():
+                    pass
+                if not in_flight:
+                    with _RUNNERS_LOCK:
+                        # jobs queued since the last claim are ours too
+                        if not ocr_store.has_pending_jobs(chat_id):
+                            if _RUNNERS.get(chat_id) is runner:
+                                del _RUNNERS[chat_id]
+                            break
+                    continue
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    content_hash = in_flight[fut]
+                    try:
+                        result = fut.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        del in_flight[fut]
+                        for fname_clean, _, _ in waiting.pop(content_hash):
+                            fail(fname_clean, e)
                         continue
-                    w_norm = word.strip()
-                    full_text_parts.append(w_norm)
-                    box = {
-                        "text": w_norm.lower(),
-                        "left": int(data["left"][i]),
-                        "top": int(data["top"][i]),
-                        "width": int(data["width"][i]),
-                        "height": int(data["height"][i]),
-                    }
-                    boxes.append(box)
-
-                full_text = " ".join(full_text_parts)
-                chat_state.image_ocr[fname_clean] = full_text.lower()
-                chat_state.image_boxes[fname_clean] = boxes
-
-                chat_cache[fname_clean] = {
-                    "text": full_text,
-                    "mtime": mtime,
-                    "boxes": boxes,
-                }
-                print(f"[{chat_state.chat_id}] OCR done for {fname_clean}")
-            except Exception as e:
-                print(f"[{chat_state.chat_id}] OCR failed for {fname_clean}: {e}")
-                chat_state.image_ocr[fname_clean] = ""
-                chat_state.image_boxes[fname_clean] = []
-                chat_cache[fname_clean] = {"text": "", "mtime": mtime, "boxes": []}
-
-    all_cache[chat_state.chat_id] = chat_cache
-    save_ocr_cache_all(all_cache)
+                    del in_flight[fut]
+                    _store_result(chat_id, runner, content_hash, result, waiting)
+            except BrokenProcessPool as e:
+                print(f"[{chat_id}] OCR worker pool broke, starting a new one.")
+                fail_waiting(e)
+                reset_pool(pool)
+                pool = get_pool()
+        state = "done"
+    except Exception as e:
+        print(f"[{chat_id}] OCR stopped: {e}")
+        fail_waiting(e)
+    finally:
+        with _RUNNERS_LOCK:
+            if _RUNNERS.get(chat_id) is runner:
+                del _RUNNERS[chat_id]
+        progress = runner["progress"]
+        progress["state"] = state
+        progress["finished_at"] = time.time()
+
+    if state == "done":
+        print(
+            f"[{chat_id}] OCR finished ({progress['deduped']} reused, "
+            f"{progress['failed']} failed, {progress['rejected']} skipped as "
+            f"text-free, ~{progress['saved_s']:.0f}s of Tesseract saved)."
+        )
+
+
+def _store_result(chat_id, runner, content_hash, result, waiting):
+    """Store one worker result and apply it to every file waiting on it."""
+    full_text, boxes, (width, height), phash, stats = result
+    files = waiting.pop(content_hash)
+    _count_ocr(runner["progress"], stats)
+    if stats["rejected"]:
+        print(f"[{chat_id}] OCR skipped for {files[0][0]} (no text likely)")
+    else:
+        print(f"[{chat_id}] OCR done for {files[0][0]}")
+
+    ocr_store.save_result(
+        content_hash,
+        full_text,
+        boxes,
+        width,
+        height,
+        phash,
+        stats["conf"],
+        passes_key(ocr_passes()),
+    )
+    chat = runner["chat"]
+    for fname_clean, mtime, size in files:
+        _link(chat, fname_clean, content_hash, mtime, size, full_text)
+    ocr_store.finish_jobs(chat_id, [f[0] for f in files])
+    runner["progress"]["done"] += len(files)
+
+
+def _count_ocr(progress, stats):
+    """
+    Add one worker result to progress. Time saved by rejected images is
+    estimated at the mean Tesseract time of the images that were OCR'd.
+    """
+    metrics.record("ocr_prepare", stats["prep_s"])
+    if stats["rejected"]:
+        progress["rejected"] += 1
+    else:
+        metrics.record("tesseract", stats["ocr_s"])
+        progress["tesseract_runs"] += 1
+        progress["extra_passes"] += stats["passes"] - 1
+        progress["tesseract_s"] += stats["ocr_s"]
+    runs = progress["tesseract_runs"]
+    mean = progress["tesseract_s"] / runs if runs else 0.0
+    progress["saved_s"] = round(progress["rejected"] * mean, 2)
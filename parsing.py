@@ -1,5 +1,6 @@
 from datetime import datetime
 import re
+import sys
 
 # WhatsApp special/invisible characters
 WHATSAPP_INVISIBLE = [
@@ -16,31 +17,86 @@ WHATSAPP_INVISIBLE = [
     "\u2069",  # PDI
 ]
 
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+# a character-class sub is several times faster than str.translate with a
+# deletion table for these non-ASCII code points
+_INVISIBLE_RE = re.compile("[" + "".join(WHATSAPP_INVISIBLE) + "]")
+
+DATE_FORMATS = [
+    "%Y-%m-%d, %I:%M:%S %p",
+    "%Y/%m/%d, %I:%M:%S %p",
+    "%d/%m/%Y, %I:%M:%S %p",
+    "%m/%d/%Y, %I:%M:%S %p",
+]
+
+# "[<datetime>] <sender>: <text>"; the char after "]" is skipped as before
+HEADER_RE = re.compile(r"\[([^\]]*)\](?:.(.*))?", re.DOTALL)
+ATTACH_RE = re.compile(r"<attached:\s*([^>]+)>", re.IGNORECASE)
+
+# fast path for DATE_FORMATS: (a)(sep)(b)(sep)(c), h:mm:ss AM|PM
+_DATE_RE = re.compile(
+    r"\s*(\d{1,4})([-/])(\d{1,2})\2(\d{1,4}),\s+(\d{1,2}):(\d{2}):(\d{2})\s+([AaPp][Mm])\s*"
+)
+# DATE_FORMATS index -> (separator, positions of year, month, day in a/b/c)
+_FORMAT_LAYOUT = {
+    0: ("-", 0, 1, 2),
+    1: ("/", 0, 1, 2),
+    2: ("/", 2, 1, 0),
+    3: ("/", 2, 0, 1),
+}
+
 
 def strip_whatsapp_invisible(s: str) -> str:
-    if not s:
+    if not s or s.isascii():
         return s
-    return "".join(ch for ch in s if ch not in WHATSAPP_INVISIBLE)
+    return _INVISIBLE_RE.sub("", s)
 
 
 def parse_datetime(dt_str: str):
     """Parse WhatsApp-style datetime like '2025-11-12, 8:41:48 PM'."""
+    dt, _ = _parse_datetime_detect(dt_str)
+    return dt
+
+
+def _parse_datetime_detect(dt_str: str):
+    """Try every DATE_FORMATS entry; return (datetime, format index) or (None, None)."""
     dt_str = dt_str.replace("\u202f", " ")  # narrow no-break space
     dt_str = strip_whatsapp_invisible(dt_str)
     dt_str = " ".join(dt_str.split())
 
-    fmts = [
-        "%Y-%m-%d, %I:%M:%S %p",
-        "%Y/%m/%d, %I:%M:%S %p",
-        "%d/%m/%Y, %I:%M:%S %p",
-        "%m/%d/%Y, %I:%M:%S %p",
-    ]
-    for fmt in fmts:
+    for i, fmt in enumerate(DATE_FORMATS):
         try:
-            return datetime.strptime(dt_str, fmt)
+            return datetime.strptime(dt_str, fmt), i
         except ValueError:
             continue
-    return None
+    return None, None
+
+
+def _parse_datetime_fixed(dt_str: str, fmt_idx: int):
+    """Parse dt_str in one known DATE_FORMATS layout without strptime."""
+    m = _DATE_RE.fullmatch(dt_str)
+    if not m:
+        return None
+    a, sep, b, c, hour, minute, second, ampm = m.groups()
+    layout_sep, yi, mi, di = _FORMAT_LAYOUT[fmt_idx]
+    if sep != layout_sep:
+        return None
+    parts = (a, b, c)
+    if len(parts[yi]) != 4:
+        return None
+    hour = int(hour)
+    if not 1 <= hour <= 12:
+        return None
+    hour %= 12
+    if ampm in ("PM", "pm", "Pm", "pM"):
+        hour += 12
+    try:
+        return datetime(
+            int(parts[yi]), int(parts[mi]), int(parts[di]), hour, int(minute), int(second)
+        )
+    except ValueError:
+        return None
 
 
 def clean_sender(name: str) -> str:
@@ -51,77 +107,170 @@ def clean_attachment(filename: str) -> str:
     return strip_whatsapp_invisible(filename).strip()
 
 
-def parse_chat(path: str):
+class Message:
     """
-    Parse WhatsApp exported txt into a list of messages:
-    [
-      {
-        "datetime": datetime|None,
-        "sender": str,
-        "text": str,
-        "attachments": [filename, ...]
-      }, ...
-    ]
+    One chat message. Slotted, with interned senders and a shared empty
+    attachments tuple, since large chats hold millions of these.
+    """
+
+    __slots__ = ("datetime", "sender", "text", "attachments")
+
+    def __init__(self, dt, sender: str, text: str, attachments=()):
+        self.datetime = dt
+        self.sender = sender
+        self.text = text
+        self.attachments = attachments
+
+    def __reduce__(self):
+        return (Message, (self.datetime, self.sender, self.text, self.attachments))
+
+    def as_dict(self):
+        return {
+            "datetime": self.datetime,
+            "sender": self.sender,
+            "text": self.text,
+            "attachments": list(self.attachments),
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (
+            self.datetime == other.datetime
+            and self.sender == other.sender
+            and self.text == other.text
+            and self.attachments == other.attachments
+        )
+
+    def __repr__(self):
+        return f"Message({self.datetime!r}, {self.sender!r}, {self.text[:40]!r})"
+
+
+_NO_ATTACHMENTS = ()
+_SYSTEM = sys.intern("System")
+_UNKNOWN = sys.intern("Unknown")
+
+
+def _new_message(dt, sender: str, text: str):
+    raw_attachments = ATTACH_RE.findall(text)
+    if raw_attachments:
+        attachments = tuple(clean_attachment(a) for a in raw_attachments)
+        text = ATTACH_RE.sub("", text)
+    else:
+        attachments = _NO_ATTACHMENTS
+    return Message(dt, sys.intern(clean_sender(sender)), text.strip(), attachments)
+
+
+def iter_messages(lines, state=None):
+    """
+    Yield a Message (datetime|None, sender, text, attachments tuple) per
+    message from an iterable of raw export lines. The date format is
+    detected on the first header line and then tried first for the rest of
+    the stream. A header it doesn't fit goes through the full list, and the
+    format found there is tried first from then on: a month-first export
+    whose first date fits both layouts switches at its first day above 12.
+    A date that fits both layouts (01/02/2023) is read in the layout of the
+    last header that only fitted one, day-first before there is one.
+
+    state, if given, is a dict whose "fmt_idx" (a DATE_FORMATS index or
+    None) is the format to start with and is kept up to date, so a later
+    parse of the rest of the export reads dates the same way.
     """
-    messages = []
     current = None
+    continuation = []
+    if state is None:
+        state = {}
+    fmt_idx = state.get("fmt_idx")
 
-    attach_re = re.compile(r"<attached:\s*([^>]+)>", re.IGNORECASE)
+    for raw_line in lines:
+        line = strip_whatsapp_invisible(raw_line.rstrip("\n"))
+        if not line.strip():
+            continue
 
-    with open(path, "r", encoding="utf-8") as f:
-        for raw_line in f:
-            line = strip_whatsapp_invisible(raw_line.rstrip("\n"))
-            if not line.strip():
-                continue
-
-            is_new_message = False
-
-            if line.startswith("[") and "]" in line and ":" in line:
-                try:
-                    closing = line.index("]")
-                    dt_str = line[1:closing]
-                    rest = line[closing + 2 :]
-                    if ": " in rest:
-                        sender, text = rest.split(": ", 1)
-                    else:
-                        sender, text = "Unknown", rest
-
-                    dt = parse_datetime(dt_str)
-                    if dt is not None:
-                        is_new_message = True
-                except Exception:
-                    is_new_message = False
-
-            if is_new_message:
-                if current:
-                    messages.append(current)
-
-                sender = clean_sender(sender)
-                text = strip_whatsapp_invisible(text)
-
-                raw_attachments = attach_re.findall(text)
-                attachments = [clean_attachment(a) for a in raw_attachments]
-                clean_text = attach_re.sub("", text).strip()
-
-                current = {
-                    "datetime": dt,
-                    "sender": sender,
-                    "text": clean_text,
-                    "attachments": attachments,
-                }
+        dt = None
+        m = HEADER_RE.match(line) if line.startswith("[") else None
+        if m and ":" in line:
+            dt_str = m.group(1)
+            if fmt_idx is not None:
+                dt = _parse_datetime_fixed(dt_str, fmt_idx)
+            if dt is None:
+                dt, detected = _parse_datetime_detect(dt_str)
+                if detected is not None:
+                    fmt_idx = state["fmt_idx"] = detected
+
+        if dt is not None:
+            if current:
+                if continuation:
+                    current.text = "\n".join([current.text] + continuation)
+                    continuation = []
+                yield current
+            rest = m.group(2) or ""
+            if ": " in rest:
+                sender, text = rest.split(": ", 1)
             else:
-                # continuation line
-                if current:
-                    current["text"] += "\n" + line
-                else:
-                    current = {
-                        "datetime": None,
-                        "sender": "System",
-                        "text": line,
-                        "attachments": [],
-                    }
+                sender, text = _UNKNOWN, rest
+            current = _new_message(dt, sender, text)
+        elif current:
+            # continuation line
+            continuation.append(line)
+        else:
+            current = Message(None, _SYSTEM, line, _NO_ATTACHMENTS)
 
     if current:
-        messages.append(current)
+        if continuation:
+            current.text = "\n".join([current.text] + continuation)
+        yield current
+
+
+def iter_chat(path: str):
+    """Stream messages from a _chat.txt file without materializing them."""
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_messages(f)
 
-    return messages
+
+def parse_chat(path: str):
+    """Parse WhatsApp exported txt into a list of messages (see iter_messages)."""
+    return list(iter_chat(path))
+
+
+class _OffsetLines:
+    """Iterate a binary file's lines as text, tracking byte offsets."""
+
+    def __init__(self, f, start: int):
+        self.f = f
+        self.offset = start
+        self.line_start = start
+
+    def __iter__(self):
+        for raw in self.f:
+            self.line_start = self.offset
+            self.offset += len(raw)
+            line = raw.decode("utf-8")
+            if line.endswith("\r\n"):
+                line = line[:-2] + "\n"
+            yield line
+
+
+def parse_chat_from(path: str, start: int = 0, fmt_idx=None):
+    """
+    Parse the messages in path from byte offset start (a line start) to EOF.
+    Returns (messages, tail_offset, end_offset, fmt_idx) where tail_offset is
+    where the last message's first line begins: re-parse from there when the
+    file grows, since appended lines may continue that message, passing the
+    returned fmt_idx (the date format in use there, see iter_messages).
+    """
+    state = {"fmt_idx": fmt_idx}
+    messages = []
+    tail_offset = start
+    next_start = start
+    with open(path, "rb") as f:
+        f.seek(start)
+        reader = _OffsetLines(f, start)
+        for msg in iter_messages(reader, state):
+            # a message is yielded once the next header has been read, so
+            # reader.line_start is then where the following message begins
+            messages.append(msg)
+            tail_offset = next_start
+            next_start = reader.line_start
+        end_offset = reader.offset
+    return messages, tail_offset, end_offset, state["fmt_idx"]
@@ -0,0 +1,267 @@
+from array import array
+import sys
+import threading
+
+import parsing
+
+GRAM = 3
+
+
+def iter_grams(text: str):
+    """
+    Yield every trigram of text plus its trailing bigram and unigram, so any
+    substring of length <= GRAM is a prefix of at least one indexed gram.
+    """
+    n = len(text)
+    for i in range(max(n - GRAM + 1, 0)):
+        yield text[i : i + GRAM]
+    for k in range(1, min(GRAM, n + 1)):
+        yield text[n - k :]
+
+
+class NgramIndex:
+    """Inverted index: gram -> set of doc ids."""
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_grams = {}
+
+    def add(self, doc_id, text: str):
+        self.remove(doc_id)
+        if not text:
+            return
+        grams = set(iter_grams(text))
+        self.doc_grams[doc_id] = grams
+        for g in grams:
+            self.postings.setdefault(g, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        grams = self.doc_grams.pop(doc_id, None)
+        if not grams:
+            return
+        for g in grams:
+            post = self.postings.get(g)
+            if post is None:
+                continue
+            post.discard(doc_id)
+            if not post:
+                del self.postings[g]
+
+    def candidates(self, q: str):
+        return find_candidates(self.postings, q)
+
+
+class AppendOnlyIndex:
+    """
+    Compact inverted index for documents that never change once added
+    (message sender/text): gram -> array of ascending doc ids. Small to
+    pickle into a snapshot and cheap to extend when messages are appended.
+    """
+
+    def __init__(self):
+        self.postings = {}
+
+    def add(self, doc_id: int, text: str):
+        postings = self.postings
+        for g in set(iter_grams(text)):
+            post = postings.get(g)
+            if post is None:
+                post = postings[g] = array("I")
+            elif post[-1] == doc_id:
+                continue
+            post.append(doc_id)
+
+    def candidates(self, q: str):
+        return find_candidates(self.postings, q)
+
+
+def find_candidates(postings, q: str):
+    """
+    Return doc ids that may contain q. Long queries intersect the posting
+    lists of their trigrams; short ones union every gram they prefix.
+    """
+    if not q:
+        return set()
+    if len(q) < GRAM:
+        out = set()
+        for g, post in postings.items():
+            if g.startswith(q):
+                out.update(post)
+        return out
+
+    grams = [g for g in set(iter_grams(q)) if len(g) == GRAM]
+    grams.sort(key=lambda g: len(postings.get(g, ())))
+    out = None
+    for g in grams:
+        post = postings.get(g)
+        if not post:
+            return set()
+        out = set(post) if out is None else out.intersection(post)
+        if not out:
+            return out
+    return out or set()
+
+
+class ChatSearchIndex:
+    """
+    Per-chat full-text index over message sender/text, attachment OCR text and
+    image notes. Doc ids are message indexes into ChatState.messages.
+    Updates may arrive from background OCR threads, so all access is locked.
+    """
+
+    def __init__(self, chat_state):
+        self.chat = chat_state
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.base = AppendOnlyIndex()
+        self.ocr = NgramIndex()
+        self.notes = NgramIndex()
+        self.ocr_docs = {}
+        self.note_docs = {}
+        self.file_msgs = {}  # cleaned filename -> [msg idx, ...]
+        self.file_notes = {}  # cleaned filename -> lower-case note
+
+    def build(self, notes_by_file=None, base=None):
+        """
+        Index the chat. base may be a (base index, file_msgs) pair restored
+        from a snapshot, in which case only OCR text and notes are indexed.
+        """
+        with self.lock:
+            self._build(notes_by_file, base)
+
+    def _build(self, notes_by_file, base):
+        self._reset()
+        for fname, note in (notes_by_file or {}).items():
+            if note:
+                self.file_notes[fname] = note.lower()
+        if base is not None:
+            self.base, self.file_msgs = base
+        else:
+            for idx, msg in enumerate(self.chat.messages):
+                self.base.add(idx, self.base_text(msg))
+                for fname in msg.attachments:
+                    key = parsing.clean_attachment(fname)
+                    self.file_msgs.setdefault(key, []).append(idx)
+        with_attachments = set()
+        for idxs in self.file_msgs.values():
+            with_attachments.update(idxs)
+        for idx in sorted(with_attachments):
+            self._index_attachments(idx)
+
+    def extend(self, first: int):
+        """
+        Index messages[first:] after they were appended or re-parsed. Only the
+        old last message may be re-indexed, and a re-parse can only lengthen
+        it, so its existing postings stay valid.
+        """
+        with self.lock:
+            messages = self.chat.messages
+            for idx in range(first, len(messages)):
+                msg = messages[idx]
+                self.base.add(idx, self.base_text(msg))
+                for fname in msg.attachments:
+                    idxs = self.file_msgs.setdefault(parsing.clean_attachment(fname), [])
+                    if not idxs or idxs[-1] != idx:
+                        idxs.append(idx)
+                if msg.attachments:
+                    self._index_attachments(idx)
+
+    def estimate_size(self) -> int:
+        """Rough size in bytes of the postings and per-doc text."""
+        getsizeof = sys.getsizeof
+        with self.lock:
+            total = 0
+            for g, post in self.base.postings.items():
+                total += getsizeof(g) + getsizeof(post)
+            for index in (self.ocr, self.notes):
+                for g, post in index.postings.items():
+                    total += getsizeof(g) + getsizeof(post)
+                total += sum(getsizeof(grams) for grams in index.doc_grams.values())
+            for docs in (self.ocr_docs, self.note_docs):
+                total += sum(getsizeof(text) for text in docs.values())
+            total += sum(getsizeof(idxs) for idxs in self.file_msgs.values())
+            return total
+
+    def base_state(self):
+        """Message-derived part of the index, for snapshots."""
+        return self.base, self.file_msgs
+
+    @staticmethod
+    def base_text(msg) -> str:
+        return f"{msg.sender} {msg.text}".lower()
+
+    def _index_attachments(self, idx):
+        msg = self.chat.messages[idx]
+        ocr_blob = ""
+        note_blob = ""
+        for fname in msg.attachments:
+            key = parsing.clean_attachment(fname)
+            if key.lower().endswith(parsing.IMAGE_EXTS):
+                ocr_blob += " " + (self.chat.image_ocr.get(key, "") or "")
+            note_blob += " " + self.file_notes.get(key, "")
+
+        if ocr_blob.strip():
+            self.ocr_docs[idx] = ocr_blob
+            self.ocr.add(idx, ocr_blob)
+        else:
+            self.ocr_docs.pop(idx, None)
+            self.ocr.remove(idx)
+
+        if note_blob.strip():
+            self.note_docs[idx] = note_blob
+            self.notes.add(idx, note_blob)
+        else:
+            self.note_docs.pop(idx, None)
+            self.notes.remove(idx)
+
+    def update_note(self, filename: str, note: str):
+        key = parsing.clean_attachment(filename)
+        with self.lock:
+            if note:
+                self.file_notes[key] = note.lower()
+            else:
+                self.file_notes.pop(key, None)
+            for idx in self.file_msgs.get(key, []):
+                self._index_attachments(idx)
+
+    def update_ocr(self, filename: str):
+        """Re-index messages referencing filename after its OCR text changed."""
+        key = parsing.clean_attachment(filename)
+        with self.lock:
+            for idx in self.file_msgs.get(key, []):
+                self._index_attachments(idx)
+
+    def search(self, q: str, search_notes: bool = True, within=None):
+        """
+        Return (base_hits, ocr_hits) as sets of message indexes matching the
+        lower-cased query q. base_hits covers sender/text and, optionally, notes.
+        within (e.g. a date-filtered range of indexes) limits which candidates
+        are verified.
+        """
+        if not q:
+            return set(), set()
+        if within is not None and not isinstance(within, range):
+            within = set(within)
+        with self.lock:
+            return self._search(q, search_notes, within)
+
+    def _search(self, q, search_notes, within):
+        messages = self.chat.messages
+
+        def candidates(index):
+            found = index.candidates(q)
+            if within is None:
+                return found
+            return [i for i in found if i in within]
+
+        base_hits = {
+            i for i in candidates(self.base) if q in self.base_text(messages[i])
+        }
+        if search_notes:
+            base_hits |= {
+                i for i in candidates(self.notes) if q in self.note_docs.get(i, "")
+            }
+        ocr_hits = {i for i in candidates(self.ocr) if q in self.ocr_docs.get(i, "")}
+        return base_hits, ocr_hits
@@ -0,0 +1,87 @@
+import hashlib
+import mmap
+import os
+import pickle
+
+import config
+
+# Bump when the parser output or snapshot layout changes
+SNAPSHOT_VERSION = 4
+
+
+def snapshot_path(chat_id: str) -> str:
+    name = hashlib.blake2b(chat_id.encode("utf-8"), digest_size=12).hexdigest()
+    return os.path.join(config.SNAPSHOT_DIR, name + ".snap")
+
+
+def file_digest(path: str, limit=None) -> str:
+    """Hash of the file's first limit bytes (the whole file by default)."""
+    h = hashlib.blake2b(digest_size=16)
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            n = 1 << 20 if remaining is None else min(1 << 20, remaining)
+            chunk = f.read(n)
+            if not chunk:
+                break
+            h.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return h.hexdigest()
+
+
+def source_info(path: str):
+    """Size, mtime and content hash identifying one version of a chat file."""
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": st.st_mtime, "hash": file_digest(path)}
+
+
+def load(chat_file: str, snap_path: str, prefix_ok: bool = False):
+    """
+    Return (source, body) saved for chat_file, or None when there is no
+    snapshot or the chat file changed. A changed mtime with the same size
+    and content hash (e.g. a copied export) still counts as unchanged. With
+    prefix_ok, a snapshot of an older version that the file only appended
+    to is returned too; its source then differs from the file's size.
+    """
+    if not os.path.exists(snap_path):
+        return None
+    try:
+        st = os.stat(chat_file)
+        with open(snap_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = pickle.load(mm)
+                if header.get("version") != SNAPSHOT_VERSION:
+                    return None
+                source = header["source"]
+                if source["size"] != st.st_size:
+                    if not (prefix_ok and source["size"] < st.st_size):
+                        return None
+                    if source["hash"] != file_digest(chat_file, source["size"]):
+                        return None
+                    return source, pickle.load(mm)
+                if source["mtime"] != st.st_mtime:
+                    if source["hash"] != file_digest(chat_file):
+                        return None
+                    source = dict(source, mtime=st.st_mtime)
+                return source, pickle.load(mm)
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot {snap_path}: {e}")
+        return None
+
+
+def save(snap_path: str, source, body):
+    """
+    Write body for the chat file version described by source (see
+    source_info) atomically; failures only cost the cache.
+    """
+    try:
+        header = {"version": SNAPSHOT_VERSION, "source": source}
+        os.makedirs(os.path.dirname(snap_path) or ".", exist_ok=True)
+        tmp = snap_path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(body, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, snap_path)
+    except Exception as e:
+        print(f"Could not write snapshot {snap_path}: {e}")
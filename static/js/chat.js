@@ -18,12 +18,23 @@ let lbNote = null;
 let lbSave = null;
 let lbStatus = null;
 
-let matchEls = [];
+let matchCount = 0;
 let matchIndex = -1;
+let matchPosByRank = {};
 let btnPrev = null;
 let btnNext = null;
 let counterEl = null;
 
+// Windowed message list: only positions [winStart, winEnd) are in the DOM.
+let messagesEl = null;
+let winStart = 0;
+let winEnd = 0;
+let winTotal = 0;
+let winLimit = 200;
+let winLoading = false;
+const MAX_WINDOWS_IN_DOM = 3;
+const SCROLL_MARGIN_PX = 1500;
+
 function initLightbox() {
   lbOverlay = document.getElementById("lightbox-overlay");
   if (!lbOverlay) return; // not on chat page
@@ -42,16 +53,12 @@ function initLightbox() {
   lbSave = document.getElementById("lightbox-save");
   lbStatus = document.getElementById("lightbox-status");
 
-  lbImages = Array.from(document.querySelectorAll("img.chat-image"));
-  lbFilenameToIndex = {};
-  lbImages.forEach((img, idx) => {
-    img.dataset.lbIndex = idx;
-    const filename = img.dataset.filename;
-    if (filename) lbFilenameToIndex[filename] = idx;
-    img.addEventListener("click", (e) => {
-      e.stopPropagation();
-      openLightbox(idx);
-    });
+  refreshLightboxImages();
+  document.addEventListener("click", (e) => {
+    const img = e.target.closest("img.chat-image");
+    if (!img) return;
+    e.stopPropagation();
+    openLightbox(Number(img.dataset.lbIndex));
   });
 
   const autoSaveCheckbox = () => {
@@ -79,15 +86,10 @@ function initLightbox() {
 
   lbJump.addEventListener("click", (e) => {
     e.stopPropagation();
-    const msgId = lbJump.dataset.msgId;
+    const pos = lbJump.dataset.pos;
     closeLightbox();
-    if (msgId) {
-      const el = document.getElementById(msgId);
-      if (el) {
-        el.scrollIntoView({ behavior: "smooth", block: "center" });
-        el.classList.add("msg-highlight");
-        setTimeout(() => el.classList.remove("msg-highlight"), 1500);
-      }
+    if (pos !== undefined && pos !== "") {
+      jumpToPosition(Number(pos)).then(flashMessage);
     }
   });
 
@@ -109,6 +111,16 @@ function initLightbox() {
   });
 }
 
+function refreshLightboxImages() {
+  lbImages = Array.from(document.querySelectorAll("img.chat-image"));
+  lbFilenameToIndex = {};
+  lbImages.forEach((img, idx) => {
+    img.dataset.lbIndex = idx;
+    const filename = img.dataset.filename;
+    if (filename) lbFilenameToIndex[filename] = idx;
+  });
+}
+
 function openLightbox(index) {
   if (!lbImages.length) return;
   lbIndex = index;
@@ -136,7 +148,8 @@ function updateLightboxUrl(filename) {
 
 function updateLightboxFromCurrent() {
   const imgEl = lbImages[lbIndex];
-  lbImg.src = imgEl.src;
+  // thumbnails in the page, the original in the lightbox
+  lbImg.src = imgEl.dataset.full || imgEl.src;
   const sender = imgEl.dataset.sender || "";
   const dt = imgEl.dataset.datetime || "";
   const msgId = imgEl.dataset.msgId || "";
@@ -148,6 +161,7 @@ function updateLightboxFromCurrent() {
   if (dt) captionText += (captionText ? " · " : "") + dt;
   lbCaption.textContent = captionText;
   lbJump.dataset.msgId = msgId;
+  lbJump.dataset.pos = imgEl.dataset.pos || "";
 
   lbImg.dataset.ocrBoxes = ocrBoxes;
   lbImg.dataset.filename = filename;
@@ -249,16 +263,171 @@ function saveImageMeta() {
     });
 }
 
+function apiUrl(params) {
+  const pageParams = new URL(window.location.href).searchParams;
+  const url = new URL(
+    "/api/chats/" + encodeURIComponent(CURRENT_CHAT) + "/messages",
+    window.location.origin
+  );
+  pageParams.forEach((value, key) => {
+    if (key !== "img") url.searchParams.set(key, value);
+  });
+  Object.entries(params).forEach(([key, value]) => {
+    url.searchParams.set(key, value);
+  });
+  return url;
+}
+
+function fetchWindow(params) {
+  return fetch(apiUrl(params)).then((r) => r.json());
+}
+
+function recordMatches(matches, offset) {
+  matches.forEach((pos, i) => {
+    matchPosByRank[offset + i] = pos;
+  });
+}
+
+function htmlToRows(html) {
+  const tpl = document.createElement("template");
+  tpl.innerHTML = html;
+  return Array.from(tpl.content.children);
+}
+
+function rowEls() {
+  return Array.from(messagesEl.querySelectorAll(":scope > .row"));
+}
+
+function pruneRows(fromTop) {
+  const rows = rowEls();
+  const maxRows = winLimit * MAX_WINDOWS_IN_DOM;
+  if (rows.length <= maxRows) return;
+  const extra = rows.length - maxRows;
+  if (fromTop) {
+    const before = messagesEl.scrollHeight;
+    rows.slice(0, extra).forEach((r) => r.remove());
+    window.scrollBy(0, messagesEl.scrollHeight - before);
+    winStart += extra;
+  } else {
+    rows.slice(rows.length - extra).forEach((r) => r.remove());
+    winEnd -= extra;
+  }
+}
+
+function applyWindow(data, mode) {
+  recordMatches(data.matches, data.match_offset);
+  matchCount = data.match_count;
+  winTotal = data.total;
+  const rows = htmlToRows(data.html);
+
+  if (mode === "append") {
+    rows.forEach((r) => messagesEl.appendChild(r));
+    winEnd = data.end;
+    pruneRows(true);
+  } else if (mode === "prepend") {
+    const before = messagesEl.scrollHeight;
+    const first = messagesEl.firstChild;
+    rows.forEach((r) => messagesEl.insertBefore(r, first));
+    window.scrollBy(0, messagesEl.scrollHeight - before);
+    winStart = data.cursor;
+    pruneRows(false);
+  } else {
+    messagesEl.replaceChildren(...rows);
+    winStart = data.cursor;
+    winEnd = data.end;
+  }
+  refreshLightboxImages();
+}
+
+function loadMore(direction) {
+  if (winLoading) return Promise.resolve();
+  let params = null;
+  if (direction > 0 && winEnd < winTotal) {
+    params = { cursor: winEnd, limit: winLimit };
+  } else if (direction < 0 && winStart > 0) {
+    const cursor = Math.max(0, winStart - winLimit);
+    params = { cursor: cursor, limit: winStart - cursor };
+  }
+  if (!params) return Promise.resolve();
+
+  winLoading = true;
+  return fetchWindow(params)
+    .then((data) => applyWindow(data, direction > 0 ? "append" : "prepend"))
+    .finally(() => {
+      winLoading = false;
+    });
+}
+
+function onWindowScroll() {
+  if (!messagesEl || winLoading) return;
+  const rect = messagesEl.getBoundingClientRect();
+  if (rect.bottom - window.innerHeight < SCROLL_MARGIN_PX) {
+    loadMore(1);
+  } else if (-rect.top < SCROLL_MARGIN_PX) {
+    loadMore(-1);
+  }
+}
+
+function initWindowing() {
+  messagesEl = document.querySelector(".messages");
+  if (!messagesEl) return;
+  winStart = Number(messagesEl.dataset.start || 0);
+  winEnd = Number(messagesEl.dataset.end || 0);
+  winTotal = Number(messagesEl.dataset.total || 0);
+  winLimit = Number(messagesEl.dataset.limit || winLimit);
+  matchCount = Number(messagesEl.dataset.matchCount || 0);
+  recordMatches(
+    JSON.parse(messagesEl.dataset.matches || "[]"),
+    Number(messagesEl.dataset.matchOffset || 0)
+  );
+  window.addEventListener("scroll", onWindowScroll, { passive: true });
+}
+
+// Resolve once the message at pos is in the DOM, fetching a window around it
+// (replacing the current one) when it is not.
+function jumpToPosition(pos) {
+  const existing = document.getElementById("msg-" + pos);
+  if (existing) return Promise.resolve(existing);
+  winLoading = true;
+  return fetchWindow({ around: pos, limit: winLimit })
+    .then((data) => {
+      applyWindow(data, "replace");
+      return document.getElementById("msg-" + pos);
+    })
+    .finally(() => {
+      winLoading = false;
+    });
+}
+
+function positionForMatch(rank) {
+  if (matchPosByRank[rank] !== undefined) {
+    return Promise.resolve(matchPosByRank[rank]);
+  }
+  winLoading = true;
+  return fetchWindow({ match: rank, limit: winLimit })
+    .then((data) => {
+      applyWindow(data, "replace");
+      return data.focus;
+    })
+    .finally(() => {
+      winLoading = false;
+    });
+}
+
+function flashMessage(el) {
+  if (!el) return;
+  el.scrollIntoView({ behavior: "smooth", block: "center" });
+  el.classList.add("msg-highlight");
+  setTimeout(() => el.classList.remove("msg-highlight"), 1500);
+}
+
 function initSearchNav() {
   btnPrev = document.getElementById("search-prev");
   btnNext = document.getElementById("search-next");
   counterEl = document.getElementById("search-counter");
   if (!btnPrev || !btnNext || !counterEl) return;
 
-  matchEls = Array.from(
-    document.querySelectorAll('.bubble[data-has-match="1"]')
-  );
-  const hasMatches = matchEls.length > 0;
+  const hasMatches = matchCount > 0;
 
   btnPrev.disabled = !hasMatches;
   btnNext.disabled = !hasMatches;
@@ -275,49 +444,47 @@ function initSearchNav() {
 
 function updateCounter() {
   if (!counterEl) return;
-  if (!matchEls.length) {
+  if (!matchCount) {
     counterEl.textContent = "0 / 0";
     return;
   }
   if (matchIndex === -1) {
-    counterEl.textContent = "0 / " + matchEls.length;
+    counterEl.textContent = "0 / " + matchCount;
   } else {
-    counterEl.textContent = matchIndex + 1 + " / " + matchEls.length;
+    counterEl.textContent = matchIndex + 1 + " / " + matchCount;
   }
 }
 
 function gotoMatch(delta) {
-  if (!matchEls.length) return;
+  if (!matchCount) return;
 
   document.querySelectorAll(".bubble.match-focus").forEach((el) => {
     el.classList.remove("match-focus");
   });
 
   if (matchIndex === -1) {
-    matchIndex = delta > 0 ? 0 : matchEls.length - 1;
+    matchIndex = delta > 0 ? 0 : matchCount - 1;
   } else {
-    matchIndex = (matchIndex + delta + matchEls.length) % matchEls.length;
+    matchIndex = (matchIndex + delta + matchCount) % matchCount;
   }
-
-  const el = matchEls[matchIndex];
-  el.classList.add("match-focus");
-  el.scrollIntoView({ behavior: "smooth", block: "center" });
-
   updateCounter();
+
+  positionForMatch(matchIndex)
+    .then((pos) => jumpToPosition(pos))
+    .then((el) => {
+      if (!el) return;
+      el.classList.add("match-focus");
+      el.scrollIntoView({ behavior: "smooth", block: "center" });
+    });
 }
 
 function initImageJumpPanel() {
   const buttons = document.querySelectorAll(".image-jump");
   buttons.forEach((btn) => {
     btn.addEventListener("click", () => {
-      const msgId = btn.dataset.msgId;
-      if (!msgId) return;
-      const el = document.getElementById(msgId);
-      if (el) {
-        el.scrollIntoView({ behavior: "smooth", block: "center" });
-        el.classList.add("msg-highlight");
-        setTimeout(() => el.classList.remove("msg-highlight"), 1500);
-      }
+      const pos = btn.dataset.pos;
+      if (pos === undefined) return;
+      jumpToPosition(Number(pos)).then(flashMessage);
     });
   });
 }
@@ -328,6 +495,7 @@ document.addEventListener("DOMContentLoaded", () => {
     return;
   }
 
+  initWindowing();
   initLightbox();
   initSearchNav();
   initImageJumpPanel();
@@ -337,5 +505,17 @@ document.addEventListener("DOMContentLoaded", () => {
   const imgParam = url.searchParams.get("img");
   if (imgParam && lbFilenameToIndex[imgParam] !== undefined) {
     openLightbox(lbFilenameToIndex[imgParam]);
+  } else if (imgParam) {
+    // image outside the rendered window: load the window holding it first
+    const btn = Array.from(document.querySelectorAll(".image-jump")).find(
+      (b) => b.dataset.filename === imgParam
+    );
+    if (btn) {
+      jumpToPosition(Number(btn.dataset.pos)).then(() => {
+        if (lbFilenameToIndex[imgParam] !== undefined) {
+          openLightbox(lbFilenameToIndex[imgParam]);
+        }
+      });
+    }
   }
 });
@@ -0,0 +1,113 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import threading
+
+import config
+import ocr_store
+
+try:
+    from PIL import Image, ImageOps, features
+
+    THUMBS_AVAILABLE = True
+    WEBP_AVAILABLE = features.check("webp")
+except ImportError:
+    THUMBS_AVAILABLE = False
+    WEBP_AVAILABLE = False
+    Image = None
+
+MIMETYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def make_thumbnail(src: str, dst: str, max_px: int, fmt: str):
+    """
+    Write a thumbnail of src fitting max_px x max_px to dst. GIFs use their
+    first frame. Executed inside worker processes, so it must stay picklable.
+    """
+    with Image.open(src) as img:
+        img.seek(0)
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_px, max_px))
+        if fmt == "jpeg" or img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+            if fmt == "jpeg":
+                flat = Image.new("RGB", img.size, (255, 255, 255))
+                flat.paste(img, mask=img.getchannel("A"))
+                img = flat
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        img.save(tmp, format=fmt.upper(), quality=config.THUMB_QUALITY)
+    os.replace(tmp, dst)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_PENDING = {}  # thumbnail path -> Future of the worker writing it
+_PENDING_LOCK = threading.Lock()
+_HASHES = {}  # image path -> (mtime, size, content hash)
+
+
+def get_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=config.THUMB_WORKERS)
+        return _POOL
+
+
+def reset_pool(pool):
+    """Drop a broken pool so the next get_pool() starts a fresh one."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def content_hash(image_path: str, st) -> str:
+    """Content hash of image_path, recomputed only when its stats change."""
+    cached = _HASHES.get(image_path)
+    if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+        return cached[2]
+    digest = ocr_store.file_hash(image_path)
+    _HASHES[image_path] = (st.st_mtime, st.st_size, digest)
+    return digest
+
+
+def pick_format(accept_webp: bool) -> str:
+    if accept_webp and WEBP_AVAILABLE and config.THUMB_FORMAT == "webp":
+        return "webp"
+    return "jpeg"
+
+
+def thumb_path(digest: str, size: str, fmt: str) -> str:
+    return os.path.join(config.THUMB_DIR, digest[:2], f"{digest}-{size}.{fmt}")
+
+
+def get_thumbnail(image_path: str, digest: str, size: str, fmt: str) -> str:
+    """
+    Path of the cached size/fmt thumbnail for the image with content hash
+    digest, generating it in the worker pool if needed. Concurrent requests
+    for the same thumbnail wait on one job. Raises if the image can't be read.
+    """
+    dst = thumb_path(digest, size, fmt)
+    if os.path.exists(dst):
+        return dst
+    pool = None  # set when this call submits the job
+    try:
+        with _PENDING_LOCK:
+            future = _PENDING.get(dst)
+            if future is None:
+                pool = get_pool()
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                future = pool.submit(
+                    make_thumbnail, image_path, dst, config.THUMB_SIZES[size], fmt
+                )
+                _PENDING[dst] = future
+                future.add_done_callback(lambda _f: _PENDING.pop(dst, None))
+        future.result()
+    except BrokenProcessPool:
+        # a worker died (e.g. killed for memory); later requests get a new pool
+        if pool is not None:
+            reset_pool(pool)
+        raise
+    return dst
@@ -0,0 +1,52 @@
+from array import array
+import bisect
+from datetime import date
+
+
+class TimeIndex:
+    """
+    Day-granular index over ChatState.messages: message indexes sorted by
+    date for range filters, and per-day message counts. Undated messages
+    (system lines) match every range, as in the original filter.
+    """
+
+    def __init__(self, messages):
+        days = [msg.datetime.toordinal() if msg.datetime else 0 for msg in messages]
+        self.undated = array("I", (i for i, d in enumerate(days) if not d))
+        dated = [i for i, d in enumerate(days) if d]
+        # exports are nearly sorted already, so this is close to linear
+        dated.sort(key=days.__getitem__)
+        self.idxs = array("I", dated)
+        self.days = array("I", (days[i] for i in dated))
+        # chat order is date order: any date range is one run of messages
+        self.in_order = all(a < b for a, b in zip(dated, dated[1:]))
+
+        self.day_counts = {}
+        for d in self.days:
+            self.day_counts[d] = self.day_counts.get(d, 0) + 1
+
+    def select(self, start_date=None, end_date=None):
+        """
+        Ascending indexes of messages dated within [start_date, end_date]
+        (either may be None) plus undated ones; a range when contiguous.
+        """
+        lo = bisect.bisect_left(self.days, start_date.toordinal()) if start_date else 0
+        hi = (
+            bisect.bisect_right(self.days, end_date.toordinal())
+            if end_date
+            else len(self.days)
+        )
+        if lo >= hi:
+            return list(self.undated)
+        if self.in_order:
+            # every message between the first and last match is in range
+            # (or undated), so only undated ones outside the run are added
+            first, last = self.idxs[lo], self.idxs[hi - 1]
+            run = range(first, last + 1)
+            outside = [i for i in self.undated if i < first or i > last]
+            return sorted(outside + list(run)) if outside else run
+        return sorted(self.undated.tolist() + self.idxs[lo:hi].tolist())
+
+    def timeline(self):
+        """[(date, message count)] for every day with messages, ascending."""
+        return [(date.fromordinal(d), n) for d, n in sorted(self.day_counts.items())]